@@ -1,119 +1,44 @@
 import streamlit as st
 import pandas as pd
-import re
-from io import BytesIO
-
-def extract_numeric_value(value):
-    """Extrae el valor numérico de una cadena como '1500 mg/kg'"""
-    if pd.isna(value) or value == 'BPF':
-        return None
-    
-    # Convertir a string si no lo es
-    value_str = str(value).strip()
-    
-    # Si es una cadena vacía después del strip, retornar None
-    if not value_str:
-        return None
-    
-    # Si ya es 'BPF', retornar None
-    if value_str.upper() == 'BPF':
-        return None
-    
-    # Buscar números (incluyendo decimales)
-    match = re.search(r'(\d+(?:\.\d+)?)', value_str)
-    if match:
-        return float(match.group(1))
-    
-    return None
+from procesamiento import (
+    resumen_a_dataframe,
+    uso_memoria_rss,
+    convert_df_to_excel,
+    convert_multiple_sheets_to_excel,
+    IndiceDosis,
+    comparar_libros,
+    ArchivoTemporal,
+    CACHE_LIBROS,
+)
 
-def process_excel_data(df):
-    """Procesa los datos del Excel según los requisitos"""
-    
-    # Validar que el DataFrame no esté vacío
-    if df.empty:
-        return pd.DataFrame(columns=['Clasificación', 'Nº INS', 'Ingrediente', 'Dosis Mínima', 'Dosis Máxima'])
-    
-    # Renombrar columnas para trabajar más fácil
-    df.columns = ['Clasificacion', 'N_INS', 'Ingrediente', 'Dosis_Maxima']
-    
-    # Limpiar espacios en blanco de las columnas de texto
-    df['Clasificacion'] = df['Clasificacion'].astype(str).str.strip()
-    df['N_INS'] = df['N_INS'].astype(str).str.strip()
-    df['Ingrediente'] = df['Ingrediente'].astype(str).str.strip()
-    
-    # Filtrar filas con valores inválidos en columnas clave
-    df = df[df['Clasificacion'] != 'None']
-    df = df[df['N_INS'] != 'None']
-    df = df[df['Clasificacion'] != '']
-    df = df[df['N_INS'] != '']
-    
-    # Si después del filtrado el DataFrame queda vacío, retornar vacío
-    if df.empty:
-        return pd.DataFrame(columns=['Clasificación', 'Nº INS', 'Ingrediente', 'Dosis Mínima', 'Dosis Máxima'])
-    
-    # Crear una lista para almacenar los resultados
-    results = []
-    
-    # Agrupar por Clasificación y N INS
-    grouped = df.groupby(['Clasificacion', 'N_INS'])
-    
-    for (clasificacion, n_ins), group in grouped:
-        # Obtener el ingrediente (tomar el primero no nulo si hay varios)
-        ingrediente_vals = group['Ingrediente'].dropna()
-        if len(ingrediente_vals) > 0 and str(ingrediente_vals.iloc[0]) != 'None':
-            ingrediente = ingrediente_vals.iloc[0]
-        else:
-            ingrediente = ''
-        
-        # Extraer valores numéricos de dosis máxima
-        dosis_values = []
-        for dosis in group['Dosis_Maxima']:
-            valor = extract_numeric_value(dosis)
-            if valor is not None:
-                dosis_values.append(valor)
-        
-        # Determinar dosis mínima y máxima
-        if len(dosis_values) > 0:
-            dosis_minima = f"{min(dosis_values)} mg/kg"
-            dosis_maxima = f"{max(dosis_values)} mg/kg"
-        else:
-            dosis_minima = "BPF"
-            dosis_maxima = "BPF"
-        
-        results.append({
-            'Clasificación': clasificacion,
-            'Nº INS': n_ins,
-            'Ingrediente': ingrediente,
-            'Dosis Mínima': dosis_minima,
-            'Dosis Máxima': dosis_maxima
-        })
-    
-    # Crear DataFrame con los resultados
-    result_df = pd.DataFrame(results)
-    
-    # Ordenar por Clasificación
-    result_df = result_df.sort_values('Clasificación').reset_index(drop=True)
-    
-    return result_df
+# Contenido estático: se construye una vez por proceso y se comparte entre sesiones
+@st.cache_resource
+def ejemplo_formato():
+    """DataFrame de ejemplo con el formato esperado del archivo"""
+    return pd.DataFrame({
+        'Clasificación': [
+            'Estabilizante / regulador acidez',
+            'Estabilizante / emulsionante',
+            'Gas de envasado / atmósfera inerte',
+            'Enriquecimiento (vitamina C)'
+        ],
+        'Nº INS': ['331(iii)', '338; 339(i)–(iii); 340(i)–(iii); 341(i)–(iii); 342(i)–(ii); 343(i)–(ii); 450(i)–(iii),(v)–(vii),(ix); 451(i),(ii); 452(i)–(v); 542', '941', '300'],
+        'Ingrediente': ['Citrato trisódico', 'Fosfatos (diversas sales fosfatadas)', 'Nitrógeno', 'Ácido ascórbico, L-'],
+        'Dosis máxima': ['BPF', '1500 mg/kg', 'BPF', 'BPF']
+    })
 
-def convert_df_to_excel(df):
-    """Convierte DataFrame a Excel en memoria"""
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Datos Procesados')
-    output.seek(0)
-    return output
+def obtener_libro(archivo, nombre):
+    """Clave y libro procesado de un archivo subido; el hash se calcula una vez por archivo"""
+    if st.session_state.get(f'{nombre}_archivo') != archivo.file_id:
+        st.session_state[f'{nombre}_clave'] = CACHE_LIBROS.clave(archivo.getvalue())
+        st.session_state[f'{nombre}_archivo'] = archivo.file_id
+    clave = st.session_state[f'{nombre}_clave']
+    return clave, CACHE_LIBROS.obtener_por_clave(clave, archivo.getvalue)
 
-def convert_multiple_sheets_to_excel(sheets_dict):
-    """Convierte múltiples DataFrames a Excel con múltiples hojas"""
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        for sheet_name, df in sheets_dict.items():
-            # Limitar el nombre de la hoja a 31 caracteres (límite de Excel)
-            safe_sheet_name = sheet_name[:31]
-            df.to_excel(writer, index=False, sheet_name=safe_sheet_name)
-    output.seek(0)
-    return output
+def olvidar_archivo(nombre):
+    """Elimina de la sesión los datos guardados para un archivo que ya no está cargado"""
+    for sufijo in ('archivo', 'clave'):
+        st.session_state.pop(f'{nombre}_{sufijo}', None)
 
 # Configuración de la página
 st.set_page_config(
@@ -130,7 +55,7 @@ st.markdown("---")
 with st.expander("📖 Instrucciones de uso"):
     st.markdown("""
     ### Formato del archivo Excel:
-    - Los datos deben comenzar desde la celda **B2** (incluyendo el título)
+    - Los datos deben tener una fila de títulos; se busca automáticamente en las primeras filas de cada hoja (si no hay títulos reconocibles, se leen desde la celda **B2**)
     - Las columnas deben ser:
         1. **Clasificación**
         2. **Nº INS**
@@ -140,6 +65,7 @@ with st.expander("📖 Instrucciones de uso"):
     
     ### Procesamiento:
     - Agrupa los ingredientes por **Clasificación** y **Nº INS**
+    - Normaliza los textos (acentos, mayúsculas, puntuación y sinónimos) para no fragmentar los grupos
     - Calcula la dosis mínima y máxima para cada grupo
     - Si no hay valores numéricos, muestra "BPF"
     - Organiza los resultados por clasificación
@@ -148,6 +74,7 @@ with st.expander("📖 Instrucciones de uso"):
     ### Descarga:
     - El archivo Excel generado contendrá **todas las hojas procesadas**
     - Cada hoja del archivo original se conserva como hoja separada en el resultado
+    - Se incluye una hoja **Resumen** con las estadísticas de cada hoja (registros, proporción BPF, rango y percentiles de dosis)
     """)
 
 st.markdown("---")
@@ -161,56 +88,30 @@ uploaded_file = st.file_uploader(
 
 if uploaded_file is not None:
     try:
-        # Leer todas las hojas del archivo Excel
-        excel_file = pd.ExcelFile(uploaded_file)
-        sheet_names = excel_file.sheet_names
+        # Los libros ya procesados en cualquier sesión se reutilizan desde la caché compartida
+        with st.spinner("Procesando hojas..."):
+            clave_libro, libro = obtener_libro(uploaded_file, 'libro')
+        original_data = libro['originales']
+        processed_data = libro['procesados']
+        resumen_hojas = libro['resumenes']
+        skipped_sheets = libro['omitidas']
+        sheet_names = libro['hojas']
         
         st.info(f"Se encontraron {len(sheet_names)} hoja(s): {', '.join(sheet_names)}")
         
-        # Diccionario para almacenar datos originales y procesados por hoja
-        original_data = {}
-        processed_data = {}
-        skipped_sheets = []
-        
-        # Procesar cada hoja
-        for sheet_name in sheet_names:
-            try:
-                with st.spinner(f"Procesando hoja '{sheet_name}'..."):
-                    # Leer desde la columna B (índice 1) y desde la fila 2
-                    df = pd.read_excel(uploaded_file, sheet_name=sheet_name, header=1, usecols="B:E")
-                    
-                    # Eliminar filas vacías
-                    df = df.dropna(how='all')
-                    
-                    # Validar que la hoja tenga las columnas esperadas
-                    expected_columns = 4  # Clasificación, Nº INS, Ingrediente, Dosis máxima
-                    if df.empty or len(df.columns) != expected_columns:
-                        skipped_sheets.append(sheet_name)
-                        continue
-                    
-                    # Guardar datos originales
-                    original_data[sheet_name] = df
-                    
-                    # Procesar los datos
-                    result_df = process_excel_data(df)
-                    
-                    # Solo guardar si hay resultados procesados
-                    if not result_df.empty:
-                        processed_data[sheet_name] = result_df
-                    else:
-                        skipped_sheets.append(sheet_name)
-                        
-            except Exception as e:
-                skipped_sheets.append(sheet_name)
-                continue
-        
         # Mostrar resultado del procesamiento
         if processed_data:
             st.success(f"✓ {len(processed_data)} hoja(s) procesada(s) exitosamente")
-            if skipped_sheets:
-                st.warning(f"⚠️ {len(skipped_sheets)} hoja(s) omitida(s) (sin datos válidos): {', '.join(skipped_sheets)}")
+            if original_data.hojas_en_disco:
+                st.info(f"💾 {len(original_data.hojas_en_disco)} hoja(s) original(es) guardada(s) en disco por superar el presupuesto de memoria")
         else:
             st.error("❌ No se encontraron hojas con datos válidos para procesar")
+        if skipped_sheets:
+            st.warning(
+                f"⚠️ {len(skipped_sheets)} hoja(s) omitida(s):\n"
+                + "\n".join(f"- **{nombre}**: {motivo}" for nombre, motivo in skipped_sheets.items())
+            )
+        if not processed_data:
             st.stop()
         
         # Crear tabs para cada hoja procesada
@@ -223,43 +124,144 @@ if uploaded_file is not None:
             with tabs[idx]:
                 st.markdown(f"### Hoja: {sheet_name}")
                 
-                # Mostrar datos originales
-                with st.expander("📄 Ver datos originales", expanded=False):
+                # Mostrar datos originales solo cuando se piden (las hojas volcadas a
+                # disco se recargan al mostrarlas)
+                if st.toggle("📄 Ver datos originales", key=f'ver_originales_{idx}'):
                     st.dataframe(original_data[sheet_name], use_container_width=True)
                 
                 # Mostrar datos procesados
                 st.markdown("**Datos Procesados:**")
                 st.dataframe(processed_data[sheet_name], use_container_width=True)
                 
-                # Estadísticas
+                # Estadísticas (calculadas durante el procesamiento)
+                resumen = resumen_hojas[sheet_name]
                 col1, col2, col3 = st.columns(3)
                 with col1:
-                    st.metric("Registros originales", len(original_data[sheet_name]))
+                    st.metric("Registros originales", resumen['Registros originales'])
                 with col2:
-                    st.metric("Registros procesados", len(processed_data[sheet_name]))
+                    st.metric("Registros procesados", resumen['Registros procesados'])
                 with col3:
-                    st.metric("Clasificaciones únicas", processed_data[sheet_name]['Clasificación'].nunique())
+                    st.metric("Clasificaciones únicas", resumen['Clasificaciones únicas'])
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric("Grupos BPF", f"{resumen['Proporción BPF']:.0%}")
+                with col2:
+                    if resumen['Dosis mínima (mg/kg)'] is not None:
+                        st.metric("Rango de dosis", f"{resumen['Dosis mínima (mg/kg)']:g} - {resumen['Dosis máxima (mg/kg)']:g} mg/kg")
+                    else:
+                        st.metric("Rango de dosis", "BPF")
+                with col3:
+                    st.metric("Dosis no interpretadas", resumen['Dosis no interpretadas'])
+        
+        # Consulta de dosis sobre todas las hojas (el índice se construye una vez por
+        # libro y lo comparten todas las sesiones desde la caché)
+        indice_dosis = CACHE_LIBROS.derivado(
+            clave_libro,
+            'indice_dosis',
+            lambda: IndiceDosis(processed_data),
+            medir=lambda indice: int(indice.grupos.memory_usage(deep=True).sum())
+        )
+        
+        st.markdown("---")
+        st.subheader("Consulta de Dosis")
+        
+        etiquetas_consulta = {
+            'maxima': 'Dosis máxima entre',
+            'minima': 'Dosis mínima entre',
+            'solapan': 'Rango de dosis que se solapa con',
+            'contenidos': 'Rango de dosis contenido en',
+        }
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            modo_consulta = st.selectbox(
+                "Tipo de consulta",
+                list(etiquetas_consulta),
+                format_func=etiquetas_consulta.get
+            )
+        with col2:
+            dosis_desde = st.number_input("Desde (mg/kg)", min_value=0.0, value=0.0)
+        with col3:
+            dosis_hasta = st.number_input("Hasta (mg/kg)", min_value=0.0, value=1000.0)
+        if dosis_desde > dosis_hasta:
+            st.info("\"Desde\" es mayor que \"Hasta\": se consultan los límites intercambiados")
+            dosis_desde, dosis_hasta = dosis_hasta, dosis_desde
+        
+        resultado_consulta = indice_dosis.consultar(modo_consulta, dosis_desde, dosis_hasta)
+        st.caption(f"{len(resultado_consulta)} de {len(indice_dosis)} grupo(s) con dosis numérica")
+        st.dataframe(resultado_consulta, use_container_width=True)
+        
+        # Comparación con otra edición del mismo libro
+        st.markdown("---")
+        st.subheader("Comparar con otra Edición")
+        
+        archivo_anterior = st.file_uploader(
+            "Carga la edición anterior del archivo",
+            type=['xlsx', 'xls'],
+            key='archivo_anterior',
+            help="Se muestran los grupos añadidos, eliminados y con dosis modificadas respecto a esta edición"
+        )
+        if archivo_anterior is None:
+            olvidar_archivo('libro_anterior')
+        else:
+            # La comparación se calcula una vez por par de libros y se guarda en la caché
+            with st.spinner("Procesando edición anterior..."):
+                clave_anterior, libro_anterior = obtener_libro(archivo_anterior, 'libro_anterior')
+                comparacion_df = CACHE_LIBROS.derivado(
+                    clave_libro,
+                    ('comparacion', clave_anterior),
+                    lambda: comparar_libros(libro_anterior['procesados'], processed_data),
+                    medir=lambda df: int(df.memory_usage(deep=True).sum())
+                )
+            
+            col1, col2, col3 = st.columns(3)
+            for columna, estado in zip((col1, col2, col3), ('Añadido', 'Eliminado', 'Modificado')):
+                with columna:
+                    st.metric(f"Grupos {estado.lower()}s", int((comparacion_df['Estado'] == estado).sum()))
+            st.dataframe(comparacion_df, use_container_width=True)
+            if st.toggle("Preparar Excel de la Comparación", key='preparar_comparacion'):
+                exportacion_comparacion = CACHE_LIBROS.derivado(
+                    clave_libro,
+                    ('comparacion_excel', clave_anterior),
+                    lambda: ArchivoTemporal(convert_df_to_excel(comparacion_df))
+                )
+                st.download_button(
+                    label="📥 Descargar Comparación",
+                    data=exportacion_comparacion.leer(),
+                    file_name="comparacion_ediciones.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                )
         
         # Botón de descarga con todas las hojas procesadas
         st.markdown("---")
         st.subheader("Descargar Resultados")
         
+        resumen_df = resumen_a_dataframe(resumen_hojas)
+        with st.expander("📊 Resumen por hoja", expanded=False):
+            st.dataframe(resumen_df, use_container_width=True)
+        
         col1, col2 = st.columns(2)
         
         with col1:
-            excel_data = convert_multiple_sheets_to_excel(processed_data)
-            st.download_button(
-                label="📥 Descargar Excel Procesado (Todas las hojas)",
-                data=excel_data,
-                file_name="datos_procesados.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                use_container_width=True
-            )
+            # El Excel se genera una vez por libro en un archivo temporal de la caché
+            # compartida y solo se lee cuando se prepara la descarga
+            if st.toggle("Preparar Excel Procesado (Todas las hojas)", key='preparar_exportacion'):
+                exportacion = CACHE_LIBROS.derivado(
+                    clave_libro,
+                    'exportacion',
+                    lambda: ArchivoTemporal(convert_multiple_sheets_to_excel(processed_data, resumen_df))
+                )
+                st.download_button(
+                    label="📥 Descargar Excel Procesado (Todas las hojas)",
+                    data=exportacion.leer(),
+                    file_name="datos_procesados.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    use_container_width=True
+                )
         
         with col2:
             # Mostrar resumen general
-            total_original = sum(len(df) for df in original_data.values())
-            total_procesado = sum(len(df) for df in processed_data.values())
+            total_original = int(resumen_df['Registros originales'].sum())
+            total_procesado = int(resumen_df['Registros procesados'].sum())
             st.metric("Total registros procesados", f"{total_procesado} de {total_original}")
         
     except Exception as e:
@@ -267,24 +269,28 @@ if uploaded_file is not None:
         st.info("Por favor, verifica que el archivo tenga el formato correcto.")
 
 else:
+    # Olvidar los datos de la sesión del archivo anterior
+    olvidar_archivo('libro')
+    olvidar_archivo('libro_anterior')
+    
     # Mostrar ejemplo cuando no hay archivo cargado
     st.info("Por favor, carga un archivo Excel para comenzar")
     
     # Mostrar ejemplo de datos
     st.subheader("Ejemplo de formato de datos")
-    ejemplo_df = pd.DataFrame({
-        'Clasificación': [
-            'Estabilizante / regulador acidez',
-            'Estabilizante / emulsionante',
-            'Gas de envasado / atmósfera inerte',
-            'Enriquecimiento (vitamina C)'
-        ],
-        'Nº INS': ['331(iii)', '338; 339(i)–(iii); 340(i)–(iii); 341(i)–(iii); 342(i)–(ii); 343(i)–(ii); 450(i)–(iii),(v)–(vii),(ix); 451(i),(ii); 452(i)–(v); 542', '941', '300'],
-        'Ingrediente': ['Citrato trisódico', 'Fosfatos (diversas sales fosfatadas)', 'Nitrógeno', 'Ácido ascórbico, L-'],
-        'Dosis máxima': ['BPF', '1500 mg/kg', 'BPF', 'BPF']
-    })
+    ejemplo_df = ejemplo_formato()
     st.dataframe(ejemplo_df, use_container_width=True)
 
+# Uso de memoria del proceso (se mide al final para incluir el procesamiento)
+st.sidebar.subheader("Memoria")
+st.sidebar.metric("Memoria RSS del proceso", f"{uso_memoria_rss() / (1024 * 1024):.1f} MB")
+st.sidebar.caption(
+    f"Libros en caché compartida: {len(CACHE_LIBROS)} "
+    f"({CACHE_LIBROS.aciertos} reutilizados, {CACHE_LIBROS.fallos} procesados), "
+    f"{CACHE_LIBROS.bytes_en_memoria / (1024 * 1024):.1f} de "
+    f"{CACHE_LIBROS.presupuesto_bytes / (1024 * 1024):.0f} MB en memoria"
+)
+
 # Footer
 st.markdown("---")
 st.markdown(
@@ -0,0 +1,87 @@
+"""Mide el arranque de la aplicación: tiempo de importación y tiempo hasta el primer render
+
+Cada medición se hace en un proceso nuevo (arranque en frío). Con --comparar se mide
+además otra revisión de git para ver el antes y el después.
+
+Uso:
+    python benchmark_inicio.py
+    python benchmark_inicio.py --comparar HEAD~1 --repeticiones 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+from io import BytesIO
+
+# Código que se ejecuta en un proceso nuevo dentro del directorio a medir
+MEDICION = r'''
+import json, sys, time
+inicio = time.perf_counter()
+import streamlit
+from streamlit.testing.v1 import AppTest
+importacion_streamlit = time.perf_counter() - inicio
+
+inicio = time.perf_counter()
+prueba = AppTest.from_file("app.py").run(timeout=60)
+primer_render = time.perf_counter() - inicio
+
+inicio = time.perf_counter()
+prueba.run(timeout=60)
+segundo_render = time.perf_counter() - inicio
+
+print(json.dumps({
+    'importacion_streamlit': importacion_streamlit,
+    'primer_render': primer_render,
+    'segundo_render': segundo_render,
+    'motores_excel_cargados': sorted(m for m in ('openpyxl', 'xlrd') if m in sys.modules),
+}))
+'''
+
+def medir(directorio, repeticiones):
+    """Ejecuta la medición varias veces en procesos nuevos y devuelve la mediana"""
+    resultados = []
+    for _ in range(repeticiones):
+        salida = subprocess.run(
+            [sys.executable, '-c', MEDICION],
+            cwd=directorio, capture_output=True, text=True, check=True
+        )
+        resultados.append(json.loads(salida.stdout.strip().splitlines()[-1]))
+
+    mediana = {
+        clave: statistics.median(r[clave] for r in resultados)
+        for clave in ('importacion_streamlit', 'primer_render', 'segundo_render')
+    }
+    mediana['motores_excel_cargados'] = resultados[-1]['motores_excel_cargados']
+    return mediana
+
+def extraer_revision(revision, destino):
+    """Extrae los archivos de una revisión de git en un directorio"""
+    contenido = subprocess.run(['git', 'archive', revision], capture_output=True, check=True).stdout
+    with tarfile.open(fileobj=BytesIO(contenido)) as archivo_tar:
+        archivo_tar.extractall(destino)
+
+def imprimir(nombre, resultado):
+    print(f"{nombre}:")
+    print(f"  Importación de streamlit:   {resultado['importacion_streamlit'] * 1000:8.1f} ms")
+    print(f"  Primer render (app.py):     {resultado['primer_render'] * 1000:8.1f} ms")
+    print(f"  Segundo render (app.py):    {resultado['segundo_render'] * 1000:8.1f} ms")
+    motores = ', '.join(resultado['motores_excel_cargados']) or 'ninguno'
+    print(f"  Motores Excel cargados:     {motores}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de arranque de la aplicación")
+    parser.add_argument('--comparar', metavar='REVISION', help="Revisión de git con la que comparar")
+    parser.add_argument('--repeticiones', type=int, default=3, help="Procesos por medición (se usa la mediana)")
+    args = parser.parse_args()
+
+    directorio_actual = os.path.dirname(os.path.abspath(__file__))
+
+    if args.comparar:
+        with tempfile.TemporaryDirectory() as directorio:
+            extraer_revision(args.comparar, directorio)
+            imprimir(f"Antes ({args.comparar})", medir(directorio, args.repeticiones))
+    imprimir("Actual", medir(directorio_actual, args.repeticiones))
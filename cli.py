@@ -0,0 +1,116 @@
+"""Procesamiento por lotes de archivos Excel de ingredientes desde la línea de comandos
+
+Ejemplos:
+    python cli.py procesar libro.xlsx -o datos_procesados.xlsx
+    python cli.py consultar libro.xlsx --modo maxima --desde 200 --hasta 1500
+    python cli.py comparar edicion_2024.xlsx edicion_2025.xlsx -o cambios.xlsx
+"""
+import argparse
+import sys
+
+from procesamiento import (
+    MODOS_CONSULTA,
+    IndiceDosis,
+    comparar_libros,
+    convert_df_to_excel,
+    convert_multiple_sheets_to_excel,
+    procesar_libro,
+    resumen_a_dataframe,
+)
+
+def _cargar_libro(ruta):
+    """Procesa un libro e informa de las hojas omitidas y su motivo por la salida de errores"""
+    libro = procesar_libro(ruta)
+    libro['originales'].liberar()
+    if libro['omitidas']:
+        for nombre, motivo in libro['omitidas'].items():
+            print(f"Hoja omitida '{nombre}': {motivo}", file=sys.stderr)
+    return libro
+
+def comando_procesar(args):
+    """Procesa un libro y guarda el resultado con todas las hojas y el resumen"""
+    libro = _cargar_libro(args.archivo)
+    if not libro['procesados']:
+        print("No se encontraron hojas con datos válidos para procesar", file=sys.stderr)
+        return 1
+
+    resumen_df = resumen_a_dataframe(libro['resumenes'])
+    salida = convert_multiple_sheets_to_excel(libro['procesados'], resumen_df=resumen_df)
+    with open(args.salida, 'wb') as archivo_salida:
+        archivo_salida.write(salida.read())
+    print(f"{len(libro['procesados'])} hoja(s) procesada(s) -> {args.salida}")
+    return 0
+
+def comando_consultar(args):
+    """Busca grupos por rango de dosis en todas las hojas de un libro"""
+    libro = _cargar_libro(args.archivo)
+    indice = IndiceDosis(libro['procesados'])
+    desde, hasta = sorted((args.desde, args.hasta))
+    resultado = indice.consultar(args.modo, desde, hasta)
+
+    if args.salida:
+        resultado.to_csv(args.salida, index=False)
+        print(f"{len(resultado)} grupo(s) -> {args.salida}")
+    else:
+        print(resultado.to_string(index=False))
+    return 0
+
+def comando_comparar(args):
+    """Compara dos ediciones de un libro y muestra los grupos que cambian"""
+    anterior = _cargar_libro(args.anterior)
+    nuevo = _cargar_libro(args.nuevo)
+    resultado = comparar_libros(anterior['procesados'], nuevo['procesados'])
+
+    if args.salida and args.salida.endswith('.csv'):
+        resultado.to_csv(args.salida, index=False)
+    elif args.salida:
+        with open(args.salida, 'wb') as archivo_salida:
+            archivo_salida.write(convert_df_to_excel(resultado).read())
+    else:
+        print(resultado.to_string(index=False))
+    conteo = resultado['Estado'].value_counts()
+    print(", ".join(f"{estado}: {conteo.get(estado, 0)}" for estado in ('Añadido', 'Eliminado', 'Modificado')),
+          file=sys.stderr)
+    return 0
+
+def crear_parser():
+    parser = argparse.ArgumentParser(description="Procesador de Datos de Ingredientes")
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    procesar = subparsers.add_parser('procesar', help="Procesa un libro y genera el Excel de resultados")
+    procesar.add_argument('archivo', help="Archivo Excel de entrada")
+    procesar.add_argument('-o', '--salida', default='datos_procesados.xlsx', help="Archivo Excel de salida")
+    procesar.set_defaults(funcion=comando_procesar)
+
+    consultar = subparsers.add_parser('consultar', help="Busca grupos por rango de dosis (mg/kg)")
+    consultar.add_argument('archivo', help="Archivo Excel de entrada")
+    consultar.add_argument(
+        '--modo',
+        choices=list(MODOS_CONSULTA),
+        default='maxima',
+        help="maxima/minima: la dosis máxima/mínima está en el rango; "
+             "solapan: el rango de dosis se solapa; contenidos: el rango de dosis está dentro"
+    )
+    consultar.add_argument('--desde', type=float, required=True, help="Límite inferior (mg/kg)")
+    consultar.add_argument('--hasta', type=float, required=True, help="Límite superior (mg/kg)")
+    consultar.add_argument('-o', '--salida', help="Guardar el resultado en un CSV")
+    consultar.set_defaults(funcion=comando_consultar)
+
+    comparar = subparsers.add_parser('comparar', help="Compara dos ediciones de un libro")
+    comparar.add_argument('anterior', help="Edición anterior del archivo Excel")
+    comparar.add_argument('nuevo', help="Edición nueva del archivo Excel")
+    comparar.add_argument('-o', '--salida', help="Guardar el resultado en un Excel (.xlsx) o CSV (.csv)")
+    comparar.set_defaults(funcion=comando_comparar)
+
+    return parser
+
+def main(argv=None):
+    args = crear_parser().parse_args(argv)
+    try:
+        return args.funcion(args)
+    except Exception as e:
+        print(f"Error al procesar el archivo: {str(e)}", file=sys.stderr)
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
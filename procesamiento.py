@@ -0,0 +1,963 @@
+"""Lógica de procesamiento de los archivos Excel de ingredientes (sin interfaz)"""
+import bisect
+import hashlib
+import os
+import pickle
+import re
+import resource
+import shutil
+import tempfile
+import threading
+import unicodedata
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import Future
+from functools import lru_cache
+from io import BytesIO
+
+import pandas as pd
+
+# Presupuesto de memoria del proceso (MB) para los libros procesados en caché.
+# Las hojas originales que lo superen se vuelcan a archivos temporales y se
+# recargan bajo demanda; los libros menos usados salen de la caché.
+MEMORIA_PROCESO_MB = float(os.environ.get('INGREDIENTES_MEMORIA_MB', '200'))
+
+# Caché de libros procesados compartida por todas las sesiones del proceso:
+# número máximo de libros en memoria y directorio opcional para guardarlos en disco
+CACHE_MAX_LIBROS = int(os.environ.get('INGREDIENTES_CACHE_LIBROS', '8'))
+CACHE_DIRECTORIO = os.environ.get('INGREDIENTES_CACHE_DIR') or None
+
+# Diccionario canónico de ingredientes: forma normalizada -> nombre canónico.
+# Las claves deben estar escritas ya normalizadas (ver normalizar_texto).
+SINONIMOS_INGREDIENTES = {
+    'acido ascorbico l': 'Ácido ascórbico, L-',
+    'acido ascorbico': 'Ácido ascórbico, L-',
+    'acido l ascorbico': 'Ácido ascórbico, L-',
+    'vitamina c': 'Ácido ascórbico, L-',
+    'citrato trisodico': 'Citrato trisódico',
+    'citrato de sodio': 'Citrato trisódico',
+    'nitrogeno': 'Nitrógeno',
+    'acido sorbico': 'Ácido sórbico',
+    'acido citrico': 'Ácido cítrico',
+    'curcumina': 'Curcumina',
+    'aspartamo': 'Aspartamo',
+    'aspartame': 'Aspartamo',
+}
+
+# Textos distintos cuya forma normalizada se recuerda entre llamadas (por función).
+# Está acotado porque el proceso de Streamlit es de larga duración y multiusuario
+TEXTOS_NORMALIZADOS_EN_CACHE = 4096
+
+# Expresiones regulares compiladas una sola vez al importar el módulo
+_PATRON_NUMERO = re.compile(r'(\d+(?:\.\d+)?)')
+_PATRON_PUNTUACION = re.compile(r'[^\w\s]|_')
+_PATRON_GUIONES = re.compile(r'[\u2010-\u2015\u2212]')
+
+def extract_numeric_value(value):
+    """Extrae el valor numérico de una cadena como '1500 mg/kg'"""
+    if pd.isna(value) or value == 'BPF':
+        return None
+    
+    # Convertir a string si no lo es
+    value_str = str(value).strip()
+    
+    # Si es una cadena vacía después del strip, retornar None
+    if not value_str:
+        return None
+    
+    # Si ya es 'BPF', retornar None
+    if value_str.upper() == 'BPF':
+        return None
+    
+    # Buscar números (incluyendo decimales)
+    match = _PATRON_NUMERO.search(value_str)
+    if match:
+        return float(match.group(1))
+    
+    return None
+
+@lru_cache(maxsize=TEXTOS_NORMALIZADOS_EN_CACHE)
+def normalizar_texto(texto):
+    """Normaliza un texto: sin acentos, minúsculas, sin puntuación y espacios simples"""
+    # Separar los acentos de las letras y descartarlos
+    texto = unicodedata.normalize('NFKD', texto)
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    texto = texto.casefold()
+    # Reemplazar la puntuación por espacios y colapsar espacios repetidos
+    texto = _PATRON_PUNTUACION.sub(' ', texto)
+    return ' '.join(texto.split())
+
+@lru_cache(maxsize=TEXTOS_NORMALIZADOS_EN_CACHE)
+def normalizar_ins(n_ins):
+    """Normaliza un Nº INS sin perder su estructura (paréntesis, comas, rangos)"""
+    n_ins = unicodedata.normalize('NFKC', n_ins).casefold()
+    # Unificar guiones y eliminar espacios internos
+    n_ins = _PATRON_GUIONES.sub('-', n_ins)
+    return ''.join(n_ins.split())
+
+@lru_cache(maxsize=TEXTOS_NORMALIZADOS_EN_CACHE)
+def ingrediente_canonico(ingrediente):
+    """Devuelve el nombre canónico de un ingrediente según el diccionario de sinónimos"""
+    return SINONIMOS_INGREDIENTES.get(normalizar_texto(ingrediente), ingrediente)
+
+def _mapear_unicos(serie, funcion):
+    """Aplica una función una sola vez por cada valor distinto de la serie"""
+    codigos, unicos = pd.factorize(serie, use_na_sentinel=False)
+    valores = pd.Series([funcion(valor) for valor in unicos], dtype=object)
+    return pd.Series(valores.to_numpy()[codigos], index=serie.index)
+
+def process_excel_data(df, normalizar=True):
+    """Procesa los datos del Excel según los requisitos
+
+    Si normalizar es True, los grupos se forman con la Clasificación y el Nº INS
+    normalizados y el Ingrediente se sustituye por su nombre canónico.
+    """
+    
+    # Validar que el DataFrame no esté vacío
+    if df.empty:
+        return pd.DataFrame(columns=['Clasificación', 'Nº INS', 'Ingrediente', 'Dosis Mínima', 'Dosis Máxima'])
+    
+    # Renombrar columnas para trabajar más fácil
+    df.columns = ['Clasificacion', 'N_INS', 'Ingrediente', 'Dosis_Maxima']
+    
+    # Limpiar espacios en blanco de las columnas de texto
+    df['Clasificacion'] = df['Clasificacion'].astype(str).str.strip()
+    df['N_INS'] = df['N_INS'].astype(str).str.strip()
+    df['Ingrediente'] = df['Ingrediente'].astype(str).str.strip()
+    
+    # Filtrar filas con valores inválidos en columnas clave
+    df = df[df['Clasificacion'] != 'None']
+    df = df[df['N_INS'] != 'None']
+    df = df[df['Clasificacion'] != '']
+    df = df[df['N_INS'] != '']
+    
+    # Si después del filtrado el DataFrame queda vacío, retornar vacío
+    if df.empty:
+        return pd.DataFrame(columns=['Clasificación', 'Nº INS', 'Ingrediente', 'Dosis Mínima', 'Dosis Máxima'])
+    
+    # Crear una lista para almacenar los resultados
+    results = []
+    
+    if normalizar:
+        # Claves de agrupación normalizadas (se calculan una vez por texto distinto)
+        df = df.assign(
+            _clave_clasificacion=_mapear_unicos(df['Clasificacion'], normalizar_texto),
+            _clave_ins=_mapear_unicos(df['N_INS'], normalizar_ins),
+            Ingrediente=_mapear_unicos(df['Ingrediente'], ingrediente_canonico)
+        )
+        grouped = df.groupby(['_clave_clasificacion', '_clave_ins'], sort=True)
+        # Cada clasificación normalizada se muestra con el primer texto que aparece en la hoja
+        primera_clasificacion = df.drop_duplicates('_clave_clasificacion').set_index('_clave_clasificacion')['Clasificacion']
+    else:
+        # Agrupar por Clasificación y N INS
+        grouped = df.groupby(['Clasificacion', 'N_INS'])
+    
+    for claves_grupo, group in grouped:
+        # Se muestra el primer texto original de cada grupo
+        if normalizar:
+            clasificacion = primera_clasificacion[claves_grupo[0]]
+        else:
+            clasificacion = group['Clasificacion'].iloc[0]
+        n_ins = group['N_INS'].iloc[0]
+        
+        # Obtener el ingrediente (tomar el primero no nulo si hay varios)
+        ingrediente_vals = group['Ingrediente'].dropna()
+        if len(ingrediente_vals) > 0 and str(ingrediente_vals.iloc[0]) != 'None':
+            ingrediente = ingrediente_vals.iloc[0]
+        else:
+            ingrediente = ''
+        
+        # Extraer valores numéricos de dosis máxima
+        dosis_values = []
+        for dosis in group['Dosis_Maxima']:
+            valor = extract_numeric_value(dosis)
+            if valor is not None:
+                dosis_values.append(valor)
+        
+        # Determinar dosis mínima y máxima
+        if len(dosis_values) > 0:
+            dosis_minima = f"{min(dosis_values)} mg/kg"
+            dosis_maxima = f"{max(dosis_values)} mg/kg"
+        else:
+            dosis_minima = "BPF"
+            dosis_maxima = "BPF"
+        
+        results.append({
+            'Clasificación': clasificacion,
+            'Nº INS': n_ins,
+            'Ingrediente': ingrediente,
+            'Dosis Mínima': dosis_minima,
+            'Dosis Máxima': dosis_maxima
+        })
+    
+    # Crear DataFrame con los resultados
+    result_df = pd.DataFrame(results)
+    
+    # Ordenar por Clasificación (con normalizar, los grupos ya salen ordenados por la
+    # clasificación normalizada y así las variantes de escritura no se separan)
+    if not normalizar:
+        result_df = result_df.sort_values('Clasificación').reset_index(drop=True)
+    
+    return result_df
+
+def procesar_datos_vectorizado(df, normalizar=True):
+    """Versión vectorizada de process_excel_data con el mismo resultado
+
+    Agrupa con groupby/agg en lugar de iterar los grupos y extrae cada dosis una
+    sola vez por valor distinto. A diferencia de process_excel_data no modifica el
+    DataFrame recibido. test_equivalencia.py comprueba que ambas coinciden.
+    """
+    columnas = ['Clasificación', 'Nº INS', 'Ingrediente', 'Dosis Mínima', 'Dosis Máxima']
+    if df.empty:
+        return pd.DataFrame(columns=columnas)
+    
+    df = df.copy(deep=False)
+    df.columns = ['Clasificacion', 'N_INS', 'Ingrediente', 'Dosis_Maxima']
+    for columna in ['Clasificacion', 'N_INS', 'Ingrediente']:
+        df[columna] = df[columna].astype(str).str.strip()
+    
+    # Mismo filtrado de valores inválidos en columnas clave
+    validas = ~df['Clasificacion'].isin(['None', '']) & ~df['N_INS'].isin(['None', ''])
+    df = df[validas]
+    if df.empty:
+        return pd.DataFrame(columns=columnas)
+    
+    if normalizar:
+        claves = [_mapear_unicos(df['Clasificacion'], normalizar_texto), _mapear_unicos(df['N_INS'], normalizar_ins)]
+        ingredientes = _mapear_unicos(df['Ingrediente'], ingrediente_canonico)
+    else:
+        claves = [df['Clasificacion'], df['N_INS']]
+        ingredientes = df['Ingrediente']
+    
+    tabla = pd.DataFrame({
+        'clasificacion': df['Clasificacion'],
+        'n_ins': df['N_INS'],
+        'ingrediente': ingredientes,
+        'dosis': _mapear_unicos(df['Dosis_Maxima'], extract_numeric_value).astype(float)
+    })
+    agrupado = tabla.groupby(claves, sort=True)
+    primeros = agrupado[['clasificacion', 'n_ins', 'ingrediente']].first()
+    if normalizar:
+        # Primer texto de cada clasificación normalizada en toda la hoja
+        primera_clasificacion = tabla['clasificacion'].groupby(claves[0], sort=False).first()
+        primeros['clasificacion'] = primera_clasificacion.reindex(primeros.index.get_level_values(0)).to_numpy()
+    minimos = agrupado['dosis'].min().tolist()
+    maximos = agrupado['dosis'].max().tolist()
+    
+    def formatear(valor):
+        return "BPF" if pd.isna(valor) else f"{valor} mg/kg"
+    
+    result_df = pd.DataFrame({
+        'Clasificación': primeros['clasificacion'].tolist(),
+        'Nº INS': primeros['n_ins'].tolist(),
+        'Ingrediente': ['' if valor == 'None' else valor for valor in primeros['ingrediente'].tolist()],
+        'Dosis Mínima': [formatear(valor) for valor in minimos],
+        'Dosis Máxima': [formatear(valor) for valor in maximos]
+    })
+    
+    # Misma ordenación que process_excel_data
+    if not normalizar:
+        result_df = result_df.sort_values('Clasificación').reset_index(drop=True)
+    
+    return result_df
+
+# Motores de procesamiento intercambiables: process_excel_data es la referencia
+MOTORES_PROCESAMIENTO = {
+    'referencia': process_excel_data,
+    'vectorizado': procesar_datos_vectorizado,
+}
+
+def es_dosis_no_interpretable(value):
+    """Indica si una dosis tiene contenido pero no es BPF ni contiene un número"""
+    if pd.isna(value):
+        return False
+    value_str = str(value).strip()
+    return bool(value_str) and value_str.upper() != 'BPF' and extract_numeric_value(value) is None
+
+def calcular_resumen_hoja(df_original, df_procesado):
+    """Calcula las estadísticas de una hoja una sola vez durante el procesamiento"""
+    # La dosis máxima es la cuarta columna de los datos originales
+    dosis = df_original.iloc[:, 3] if len(df_original.columns) > 3 else pd.Series(dtype=object)
+    valores = pd.to_numeric(_mapear_unicos(dosis, extract_numeric_value), errors='coerce').dropna()
+    fallos = int(_mapear_unicos(dosis, es_dosis_no_interpretable).sum())
+    
+    registros_procesados = len(df_procesado)
+    grupos_bpf = int((df_procesado['Dosis Máxima'] == 'BPF').sum()) if registros_procesados else 0
+    
+    def estadistica(funcion):
+        return float(funcion(valores)) if len(valores) else None
+    
+    return {
+        'Registros originales': len(df_original),
+        'Registros procesados': registros_procesados,
+        'Clasificaciones únicas': df_procesado['Clasificación'].nunique() if registros_procesados else 0,
+        'Proporción BPF': grupos_bpf / registros_procesados if registros_procesados else 0.0,
+        'Dosis mínima (mg/kg)': estadistica(lambda v: v.min()),
+        'Percentil 25 (mg/kg)': estadistica(lambda v: v.quantile(0.25)),
+        'Mediana (mg/kg)': estadistica(lambda v: v.quantile(0.5)),
+        'Percentil 75 (mg/kg)': estadistica(lambda v: v.quantile(0.75)),
+        'Dosis máxima (mg/kg)': estadistica(lambda v: v.max()),
+        'Dosis no interpretadas': fallos
+    }
+
+def resumen_a_dataframe(resumen_hojas):
+    """Convierte los resúmenes por hoja en una tabla con una fila por hoja"""
+    filas = [{'Hoja': nombre, **resumen} for nombre, resumen in resumen_hojas.items()]
+    return pd.DataFrame(filas)
+
+def uso_memoria_rss():
+    """Devuelve la memoria residente (RSS) actual del proceso en bytes"""
+    try:
+        with open('/proc/self/status') as status:
+            for linea in status:
+                if linea.startswith('VmRSS:'):
+                    return int(linea.split()[1]) * 1024
+    except OSError:
+        pass
+    # Sin /proc solo se conoce el pico (KB en Linux, bytes en macOS)
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico if os.uname().sysname == 'Darwin' else pico * 1024
+
+class AlmacenHojas(MutableMapping):
+    """Diccionario de DataFrames con presupuesto de memoria y volcado a disco
+
+    Las hojas que no caben en el presupuesto se guardan en un directorio temporal
+    y se vuelven a leer cada vez que se accede a ellas. El directorio se elimina
+    con liberar() o cuando el almacén deja de usarse.
+    """
+    
+    def __init__(self, presupuesto_bytes):
+        self.presupuesto_bytes = presupuesto_bytes
+        self.bytes_en_memoria = 0
+        # nombre -> (DataFrame, tamaño) si está en memoria o ruta si está en disco
+        self._hojas = {}
+        self._directorio = None
+    
+    def __getitem__(self, nombre):
+        hoja = self._hojas[nombre]
+        if isinstance(hoja, str):
+            return pd.read_pickle(hoja)
+        return hoja[0]
+    
+    def __setitem__(self, nombre, df):
+        if nombre in self._hojas:
+            del self[nombre]
+        tamano = int(df.memory_usage(deep=True).sum())
+        if self.bytes_en_memoria + tamano <= self.presupuesto_bytes:
+            self._hojas[nombre] = (df, tamano)
+            self.bytes_en_memoria += tamano
+            return
+        if self._directorio is None:
+            self._directorio = tempfile.TemporaryDirectory(prefix='ingredientes_')
+        descriptor, ruta = tempfile.mkstemp(suffix='.pkl', dir=self._directorio.name)
+        os.close(descriptor)
+        df.to_pickle(ruta)
+        self._hojas[nombre] = ruta
+    
+    def __delitem__(self, nombre):
+        hoja = self._hojas.pop(nombre)
+        if isinstance(hoja, str):
+            os.remove(hoja)
+        else:
+            self.bytes_en_memoria -= hoja[1]
+    
+    def __iter__(self):
+        return iter(self._hojas)
+    
+    def __len__(self):
+        return len(self._hojas)
+    
+    def guardar_hoja(self, nombre, ruta):
+        """Escribe la hoja en ruta (pickle); si ya está en disco se copia sin cargarla"""
+        hoja = self._hojas[nombre]
+        if isinstance(hoja, str):
+            shutil.copyfile(hoja, ruta)
+        else:
+            hoja[0].to_pickle(ruta)
+    
+    @property
+    def hojas_en_disco(self):
+        """Nombres de las hojas que se han volcado a disco"""
+        return [nombre for nombre, hoja in self._hojas.items() if isinstance(hoja, str)]
+    
+    def liberar(self):
+        """Elimina los archivos temporales y vacía el almacén"""
+        self._hojas.clear()
+        self.bytes_en_memoria = 0
+        if self._directorio is not None:
+            self._directorio.cleanup()
+            self._directorio = None
+
+class ArchivoTemporal:
+    """Contenido guardado en un archivo temporal que se lee solo cuando se pide
+
+    El archivo se elimina con liberar() o cuando el objeto deja de usarse.
+    """
+    
+    def __init__(self, buffer):
+        self._directorio = tempfile.TemporaryDirectory(prefix='ingredientes_')
+        self.ruta = os.path.join(self._directorio.name, 'contenido')
+        buffer.seek(0)
+        with open(self.ruta, 'wb') as archivo:
+            shutil.copyfileobj(buffer, archivo)
+    
+    def leer(self):
+        """Devuelve el contenido del archivo en bytes"""
+        with open(self.ruta, 'rb') as archivo:
+            return archivo.read()
+    
+    def liberar(self):
+        """Elimina el archivo temporal"""
+        self._directorio.cleanup()
+
+def convert_df_to_excel(df):
+    """Convierte DataFrame a Excel en memoria"""
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False, sheet_name='Datos Procesados')
+    output.seek(0)
+    return output
+
+def convert_multiple_sheets_to_excel(sheets_dict, resumen_df=None):
+    """Convierte múltiples DataFrames a Excel con múltiples hojas
+
+    Si se indica resumen_df, se añade al final como hoja "Resumen".
+    """
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        for sheet_name, df in sheets_dict.items():
+            # Limitar el nombre de la hoja a 31 caracteres (límite de Excel)
+            safe_sheet_name = sheet_name[:31]
+            df.to_excel(writer, index=False, sheet_name=safe_sheet_name)
+        if resumen_df is not None:
+            # Evitar chocar con una hoja de datos que ya se llame "Resumen"
+            nombre_resumen = 'Resumen'
+            while nombre_resumen in writer.sheets:
+                nombre_resumen = f'_{nombre_resumen}'
+            resumen_df.to_excel(writer, index=False, sheet_name=nombre_resumen[:31])
+    output.seek(0)
+    return output
+
+# Filas que se leen de cada hoja para localizar el encabezado
+FILAS_MUESTRA_ENCABEZADO = 30
+
+# Reconocedores de cada columna esperada sobre el texto normalizado del encabezado:
+# (reconocedor, reconocedor genérico). Se toma la primera columna que cumple el
+# primero y, si ninguna lo cumple, la columna genérica solo si es la única
+COLUMNAS_ENCABEZADO = {
+    'Clasificación': (lambda texto: texto.startswith('clasificacion'), None),
+    'Nº INS': (lambda texto: 'ins' in texto.split(), None),
+    'Ingrediente': (lambda texto: texto.startswith('ingrediente'), None),
+    'Dosis máxima': (
+        lambda texto: texto.split()[:2] in (['dosis', 'maxima'], ['dosis', 'max']),
+        lambda texto: texto.startswith('dosis'),
+    ),
+}
+
+def detectar_encabezado(muestra):
+    """Busca el encabezado en las primeras filas de una hoja (leída con header=None)
+
+    Devuelve (fila, columnas) con la fila del encabezado y la posición de cada
+    columna en el orden de COLUMNAS_ENCABEZADO, o None si no se encuentra.
+    """
+    for fila, valores in enumerate(muestra.itertuples(index=False, name=None)):
+        textos = [normalizar_texto(str(valor)) if not pd.isna(valor) else '' for valor in valores]
+        columnas = []
+        for reconocer, generico in COLUMNAS_ENCABEZADO.values():
+            posicion = next((i for i, texto in enumerate(textos) if i not in columnas and reconocer(texto)), None)
+            if posicion is None and generico is not None:
+                candidatas = [i for i, texto in enumerate(textos) if i not in columnas and generico(texto)]
+                if len(candidatas) == 1:
+                    posicion = candidatas[0]
+            if posicion is None:
+                break
+            columnas.append(posicion)
+        else:
+            return fila, columnas
+    return None
+
+def _ubicar_datos(muestra):
+    """Devuelve (fila, columnas, motivo) con la ubicación de los datos de una hoja
+
+    Si no hay encabezado reconocible se usa el formato clásico (encabezado en la
+    fila 2, columnas B:E) siempre que haya datos en B:E debajo de la fila 2,
+    aunque falte algún título.
+    Si la hoja no se puede procesar, fila y columnas son None y motivo lo explica.
+    """
+    if muestra.dropna(how='all').empty:
+        return None, None, "Hoja vacía"
+    
+    encabezado = detectar_encabezado(muestra)
+    if encabezado is not None:
+        fila, columnas = encabezado
+        return fila, columnas, None
+    
+    if muestra.shape[1] >= 5 and muestra.iloc[2:, 1:5].notna().any(axis=None):
+        return 1, [1, 2, 3, 4], None
+    
+    return None, None, (
+        f"No se encontró el encabezado ({', '.join(COLUMNAS_ENCABEZADO)}) "
+        f"en las primeras {FILAS_MUESTRA_ENCABEZADO} filas"
+    )
+
+def procesar_libro(archivo, presupuesto_bytes=None):
+    """Lee y procesa todas las hojas de un libro de Excel
+
+    De cada hoja se lee primero una muestra para localizar el encabezado y después
+    solo el rango de datos. Devuelve un diccionario con:
+    - 'hojas': nombres de todas las hojas del libro
+    - 'originales': datos originales por hoja (AlmacenHojas)
+    - 'procesados': datos procesados por hoja
+    - 'resumenes': resumen de cada hoja procesada (ver calcular_resumen_hoja)
+    - 'omitidas': hojas omitidas con el motivo (hoja -> motivo)
+    """
+    if presupuesto_bytes is None:
+        presupuesto_bytes = int(MEMORIA_PROCESO_MB * 1024 * 1024)
+    
+    excel_file = pd.ExcelFile(archivo)
+    
+    # Diccionarios para almacenar datos originales y procesados por hoja
+    original_data = AlmacenHojas(presupuesto_bytes)
+    processed_data = {}
+    resumen_hojas = {}
+    skipped_sheets = {}
+    
+    # Procesar cada hoja
+    for sheet_name in excel_file.sheet_names:
+        try:
+            # Localizar el encabezado con una muestra de las primeras filas
+            muestra = pd.read_excel(excel_file, sheet_name=sheet_name, header=None, nrows=FILAS_MUESTRA_ENCABEZADO)
+            fila, columnas, motivo = _ubicar_datos(muestra)
+            if motivo:
+                skipped_sheets[sheet_name] = motivo
+                continue
+            
+            # Leer solo las columnas detectadas y ponerlas en el orden esperado. Con
+            # dtype=object un Nº INS numérico no pasa a float por las celdas vacías
+            df = pd.read_excel(excel_file, sheet_name=sheet_name, header=fila, usecols=columnas, dtype=object)
+            orden = sorted(columnas)
+            df = df.iloc[:, [orden.index(columna) for columna in columnas]]
+            
+            # Eliminar filas vacías
+            df = df.dropna(how='all')
+            if df.empty:
+                skipped_sheets[sheet_name] = "El encabezado no tiene filas de datos debajo"
+                continue
+            
+            # Guardar datos originales
+            original_data[sheet_name] = df
+            
+            # Procesar los datos (el motor vectorizado no modifica los datos originales)
+            result_df = procesar_datos_vectorizado(df)
+            
+            # Solo guardar si hay resultados procesados
+            if not result_df.empty:
+                processed_data[sheet_name] = result_df
+                resumen_hojas[sheet_name] = calcular_resumen_hoja(df, result_df)
+            else:
+                skipped_sheets[sheet_name] = "Ninguna fila tiene Clasificación y Nº INS"
+                
+        except Exception as e:
+            skipped_sheets[sheet_name] = f"Error al leer la hoja: {str(e)}"
+            continue
+    
+    return {
+        'hojas': excel_file.sheet_names,
+        'originales': original_data,
+        'procesados': processed_data,
+        'resumenes': resumen_hojas,
+        'omitidas': skipped_sheets
+    }
+
+def dosis_a_numero(dosis):
+    """Convierte una dosis procesada ('1500.0 mg/kg' o 'BPF') a número o None"""
+    if dosis == 'BPF':
+        return None
+    return float(dosis.split()[0])
+
+class _NodoIntervalos:
+    """Nodo de un árbol de intervalos centrado"""
+    __slots__ = ('centro', 'por_minimo', 'por_maximo', 'izquierda', 'derecha')
+
+class IndiceDosis:
+    """Índice de intervalos [dosis mínima, dosis máxima] de los grupos de un libro
+
+    Se construye una vez a partir de los datos procesados de todas las hojas. Los
+    grupos BPF no tienen dosis numérica y no forman parte del índice.
+    """
+    
+    def __init__(self, processed_data):
+        grupos = _unir_hojas(processed_data)
+        
+        minimos = grupos['Dosis Mínima'].map(dosis_a_numero)
+        maximos = grupos['Dosis Máxima'].map(dosis_a_numero)
+        con_dosis = minimos.notna()
+        self.grupos = grupos[con_dosis].reset_index(drop=True)
+        self._minimos = minimos[con_dosis].astype(float).tolist()
+        self._maximos = maximos[con_dosis].astype(float).tolist()
+        
+        # Listas ordenadas de extremos para búsquedas binarias
+        self._orden_minimo = sorted(range(len(self._minimos)), key=self._minimos.__getitem__)
+        self._minimos_ordenados = [self._minimos[i] for i in self._orden_minimo]
+        self._orden_maximo = sorted(range(len(self._maximos)), key=self._maximos.__getitem__)
+        self._maximos_ordenados = [self._maximos[i] for i in self._orden_maximo]
+        
+        # Tabla dispersa de mínimos de la dosis máxima sobre el orden por dosis mínima:
+        # _tabla_maximos[k][p] es la posición con menor dosis máxima en [p, p + 2^k)
+        maximos_por_minimo = [self._maximos[i] for i in self._orden_minimo]
+        self._tabla_maximos = [list(range(len(maximos_por_minimo)))]
+        paso = 1
+        while 2 * paso <= len(maximos_por_minimo):
+            anterior = self._tabla_maximos[-1]
+            self._tabla_maximos.append([
+                a if maximos_por_minimo[a] <= maximos_por_minimo[b] else b
+                for a, b in zip(anterior, anterior[paso:])
+            ])
+            paso *= 2
+        self._maximos_por_minimo = maximos_por_minimo
+        
+        self._raiz = self._construir(list(range(len(self._minimos))))
+    
+    def __len__(self):
+        return len(self.grupos)
+    
+    def _construir(self, ids):
+        """Construye el árbol de intervalos centrado para los grupos indicados"""
+        if not ids:
+            return None
+        # El centro es un extremo real, así que al menos un intervalo lo contiene
+        extremos = sorted([self._minimos[i] for i in ids] + [self._maximos[i] for i in ids])
+        centro = extremos[len(extremos) // 2]
+        
+        nodo = _NodoIntervalos()
+        nodo.centro = centro
+        en_centro = [i for i in ids if self._minimos[i] <= centro <= self._maximos[i]]
+        nodo.por_minimo = sorted(en_centro, key=self._minimos.__getitem__)
+        nodo.por_maximo = sorted(en_centro, key=self._maximos.__getitem__, reverse=True)
+        nodo.izquierda = self._construir([i for i in ids if self._maximos[i] < centro])
+        nodo.derecha = self._construir([i for i in ids if self._minimos[i] > centro])
+        return nodo
+    
+    def _resultado(self, ids):
+        """Devuelve las filas de los grupos indicados en el orden del índice"""
+        return self.grupos.iloc[sorted(ids)].reset_index(drop=True)
+    
+    def solapan(self, desde, hasta):
+        """Grupos cuyo intervalo de dosis se solapa con [desde, hasta]"""
+        ids = []
+        pendientes = [self._raiz]
+        while pendientes:
+            nodo = pendientes.pop()
+            if nodo is None:
+                continue
+            if hasta < nodo.centro:
+                # Solo pueden solapar los que empiezan antes de 'hasta'
+                for i in nodo.por_minimo:
+                    if self._minimos[i] > hasta:
+                        break
+                    ids.append(i)
+                pendientes.append(nodo.izquierda)
+            elif desde > nodo.centro:
+                # Solo pueden solapar los que terminan después de 'desde'
+                for i in nodo.por_maximo:
+                    if self._maximos[i] < desde:
+                        break
+                    ids.append(i)
+                pendientes.append(nodo.derecha)
+            else:
+                ids.extend(nodo.por_minimo)
+                pendientes.append(nodo.izquierda)
+                pendientes.append(nodo.derecha)
+        return self._resultado(ids)
+    
+    def _posicion_maximo_menor(self, inicio, fin):
+        """Posición (en el orden por dosis mínima) con menor dosis máxima en [inicio, fin)"""
+        nivel = (fin - inicio).bit_length() - 1
+        a = self._tabla_maximos[nivel][inicio]
+        b = self._tabla_maximos[nivel][fin - (1 << nivel)]
+        return a if self._maximos_por_minimo[a] <= self._maximos_por_minimo[b] else b
+    
+    def contenidos_en(self, desde, hasta):
+        """Grupos cuyo intervalo de dosis está contenido en [desde, hasta]
+        
+        Los grupos con dosis mínima en el rango forman un tramo contiguo del orden por
+        dosis mínima; dentro de él se extrae recursivamente la menor dosis máxima
+        mientras no supere 'hasta'. Coste O(log n + k) para k grupos encontrados.
+        """
+        ids = []
+        pendientes = [(bisect.bisect_left(self._minimos_ordenados, desde),
+                       bisect.bisect_right(self._minimos_ordenados, hasta))]
+        while pendientes:
+            inicio, fin = pendientes.pop()
+            if inicio >= fin:
+                continue
+            posicion = self._posicion_maximo_menor(inicio, fin)
+            if self._maximos_por_minimo[posicion] > hasta:
+                continue
+            ids.append(self._orden_minimo[posicion])
+            pendientes.append((inicio, posicion))
+            pendientes.append((posicion + 1, fin))
+        return self._resultado(ids)
+    
+    def maxima_entre(self, desde, hasta):
+        """Grupos cuya dosis máxima está entre desde y hasta (incluidos)"""
+        inicio = bisect.bisect_left(self._maximos_ordenados, desde)
+        fin = bisect.bisect_right(self._maximos_ordenados, hasta)
+        return self._resultado(self._orden_maximo[inicio:fin])
+    
+    def minima_entre(self, desde, hasta):
+        """Grupos cuya dosis mínima está entre desde y hasta (incluidos)"""
+        inicio = bisect.bisect_left(self._minimos_ordenados, desde)
+        fin = bisect.bisect_right(self._minimos_ordenados, hasta)
+        return self._resultado(self._orden_minimo[inicio:fin])
+    
+    def consultar(self, modo, desde, hasta):
+        """Ejecuta una consulta por nombre de modo (ver MODOS_CONSULTA)"""
+        return getattr(self, MODOS_CONSULTA[modo])(desde, hasta)
+
+# Modos de consulta disponibles: nombre -> método de IndiceDosis
+MODOS_CONSULTA = {
+    'maxima': 'maxima_entre',
+    'minima': 'minima_entre',
+    'solapan': 'solapan',
+    'contenidos': 'contenidos_en',
+}
+
+def _claves_grupo(tabla):
+    """Hash de (hoja, Clasificación, Nº INS) normalizados para cada fila de la tabla"""
+    claves = pd.DataFrame({
+        'hoja': tabla['Hoja'],
+        'clasificacion': _mapear_unicos(tabla['Clasificación'].astype(str), normalizar_texto),
+        'n_ins': _mapear_unicos(tabla['Nº INS'].astype(str), normalizar_ins)
+    })
+    return pd.util.hash_pandas_object(claves, index=False)
+
+def _unir_hojas(processed_data):
+    """Une los datos procesados de todas las hojas en una tabla con columna 'Hoja'"""
+    columnas = ['Hoja', 'Clasificación', 'Nº INS', 'Ingrediente', 'Dosis Mínima', 'Dosis Máxima']
+    tablas = [df.assign(Hoja=sheet_name) for sheet_name, df in processed_data.items()]
+    if not tablas:
+        return pd.DataFrame(columns=columnas)
+    return pd.concat(tablas, ignore_index=True)[columnas]
+
+def comparar_libros(procesados_anterior, procesados_nuevo):
+    """Compara dos ediciones de un libro ya procesadas (hoja -> DataFrame procesado)
+
+    Los grupos se emparejan por hoja, Clasificación y Nº INS normalizados en una
+    sola unión por hash. Devuelve los grupos añadidos, eliminados y con dosis
+    distintas, con las dosis anteriores y nuevas.
+    """
+    anterior = _unir_hojas(procesados_anterior)
+    nuevo = _unir_hojas(procesados_nuevo)
+    anterior['_clave'] = _claves_grupo(anterior)
+    nuevo['_clave'] = _claves_grupo(nuevo)
+    
+    union = anterior.merge(nuevo, on='_clave', how='outer', suffixes=(' anterior', ' nueva'), indicator=True)
+    
+    dosis_distinta = (
+        (union['Dosis Mínima anterior'] != union['Dosis Mínima nueva'])
+        | (union['Dosis Máxima anterior'] != union['Dosis Máxima nueva'])
+    )
+    estado = pd.Series('Sin cambios', index=union.index)
+    estado[union['_merge'] == 'right_only'] = 'Añadido'
+    estado[union['_merge'] == 'left_only'] = 'Eliminado'
+    estado[(union['_merge'] == 'both') & dosis_distinta] = 'Modificado'
+    
+    # Datos descriptivos de la edición nueva, o de la anterior si el grupo se eliminó
+    def columna(nombre):
+        return union[f'{nombre} nueva'].fillna(union[f'{nombre} anterior'])
+    
+    resultado = pd.DataFrame({
+        'Estado': estado,
+        'Hoja': columna('Hoja'),
+        'Clasificación': columna('Clasificación'),
+        'Nº INS': columna('Nº INS'),
+        'Ingrediente': columna('Ingrediente'),
+        'Dosis Mínima anterior': union['Dosis Mínima anterior'],
+        'Dosis Máxima anterior': union['Dosis Máxima anterior'],
+        'Dosis Mínima nueva': union['Dosis Mínima nueva'],
+        'Dosis Máxima nueva': union['Dosis Máxima nueva']
+    })
+    resultado = resultado[resultado['Estado'] != 'Sin cambios']
+    return resultado.sort_values(['Hoja', 'Estado', 'Clasificación', 'Nº INS'], kind='stable').reset_index(drop=True)
+
+def _tamano_libro(libro):
+    """Bytes en memoria de un libro procesado (originales en memoria y datos procesados)"""
+    procesados = sum(int(df.memory_usage(deep=True).sum()) for df in libro['procesados'].values())
+    return libro['originales'].bytes_en_memoria + procesados
+
+class CacheLibros:
+    """Caché de libros procesados compartida entre sesiones, indexada por el hash del contenido
+
+    Si varias sesiones piden a la vez el mismo libro, solo la primera lo procesa y
+    las demás esperan su resultado. Los resultados son compartidos y no deben
+    modificarse. Con un directorio, los resultados también se guardan en disco y
+    sobreviven a reinicios del proceso.
+
+    La caché está acotada por número de libros y por el presupuesto de memoria del
+    proceso: cada libro se procesa con ese presupuesto y, si entre todos lo superan,
+    salen los menos usados (el último libro pedido se conserva siempre).
+    """
+    
+    # Cambiar al modificar el procesamiento para invalidar los resultados en disco
+    VERSION = 3
+    
+    def __init__(self, max_libros=CACHE_MAX_LIBROS, directorio=CACHE_DIRECTORIO, procesar=None,
+                 presupuesto_bytes=None):
+        self.max_libros = max_libros
+        self.directorio = directorio
+        self.presupuesto_bytes = presupuesto_bytes or int(MEMORIA_PROCESO_MB * 1024 * 1024)
+        self._procesar = procesar or procesar_libro
+        # clave -> (libro, tamaño en memoria)
+        self._libros = OrderedDict()
+        self._en_curso = {}
+        # clave -> {nombre: resultado derivado del libro} (ver derivado)
+        self._derivados = {}
+        self._lock = threading.Lock()
+        self.bytes_en_memoria = 0
+        self.aciertos = 0
+        self.fallos = 0
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+    
+    def __len__(self):
+        return len(self._libros)
+    
+    @staticmethod
+    def clave(contenido):
+        """Clave de caché (SHA-256) del contenido de un libro"""
+        return hashlib.sha256(contenido).hexdigest()
+    
+    def obtener(self, contenido):
+        """Devuelve el libro procesado (ver procesar_libro) para el contenido dado"""
+        return self.obtener_por_clave(self.clave(contenido), lambda: contenido)
+    
+    def obtener_por_clave(self, clave, leer_contenido):
+        """Como obtener, con la clave ya calculada
+
+        leer_contenido devuelve los bytes del libro y solo se llama si hay que procesarlo.
+        """
+        with self._lock:
+            if clave in self._libros:
+                self._libros.move_to_end(clave)
+                self.aciertos += 1
+                return self._libros[clave][0]
+            futuro = self._en_curso.get(clave)
+            if futuro is not None:
+                # Otro hilo ya lo está procesando: esperar su resultado
+                self.aciertos += 1
+                propietario = False
+            else:
+                futuro = Future()
+                self._en_curso[clave] = futuro
+                self.fallos += 1
+                propietario = True
+        
+        if not propietario:
+            return futuro.result()
+        
+        try:
+            libro = self._leer_disco(clave)
+            if libro is None:
+                libro = self._procesar(BytesIO(leer_contenido()), self.presupuesto_bytes)
+                self._escribir_disco(clave, libro)
+            tamano = _tamano_libro(libro)
+        except BaseException as e:
+            # Los errores no se guardan: se notifican a quienes esperaban
+            with self._lock:
+                del self._en_curso[clave]
+            futuro.set_exception(e)
+            raise
+        
+        with self._lock:
+            self._libros[clave] = (libro, tamano)
+            self.bytes_en_memoria += tamano
+            del self._en_curso[clave]
+            self._expulsar()
+        futuro.set_result(libro)
+        return libro
+    
+    def derivado(self, clave, nombre, construir, medir=None):
+        """Resultado derivado del libro con esa clave (índice, exportación...), construido una vez
+
+        Se guarda junto al libro, cuenta en el presupuesto con el tamaño que devuelva
+        medir y sale de la caché con él. Si el libro ya no está en caché, el resultado
+        se construye y se devuelve sin guardarlo.
+        """
+        with self._lock:
+            derivados = self._derivados.get(clave, {})
+            if nombre in derivados:
+                return derivados[nombre]
+        
+        valor = construir()
+        tamano = medir(valor) if medir else 0
+        with self._lock:
+            if clave not in self._libros:
+                return valor
+            derivados = self._derivados.setdefault(clave, {})
+            if nombre in derivados:
+                # Otra sesión lo construyó a la vez: se comparte el primero
+                return derivados[nombre]
+            derivados[nombre] = valor
+            libro, tamano_libro = self._libros[clave]
+            self._libros[clave] = (libro, tamano_libro + tamano)
+            self.bytes_en_memoria += tamano
+            self._expulsar()
+        return valor
+    
+    def _expulsar(self):
+        """Saca los libros menos usados mientras se superen los límites (con el lock tomado)"""
+        # Los libros expulsados no se liberan explícitamente porque otra sesión
+        # puede seguir usándolos; sus archivos temporales se borran al recolectarlos
+        while len(self._libros) > 1 and (
+            len(self._libros) > self.max_libros or self.bytes_en_memoria > self.presupuesto_bytes
+        ):
+            clave, (_, tamano) = self._libros.popitem(last=False)
+            self._derivados.pop(clave, None)
+            self.bytes_en_memoria -= tamano
+    
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, f'{clave}.v{self.VERSION}')
+    
+    def _leer_disco(self, clave):
+        """Carga un libro guardado en disco o devuelve None si no existe o no es válido
+
+        Las hojas originales se leen de una en una y pasan por el presupuesto de
+        memoria, así que las que no caben vuelven a volcarse a disco.
+        """
+        if not self.directorio or not os.path.isdir(self._ruta(clave)):
+            return None
+        originales = AlmacenHojas(self.presupuesto_bytes)
+        try:
+            with open(os.path.join(self._ruta(clave), 'libro.pkl'), 'rb') as archivo:
+                guardado = pickle.load(archivo)
+            for posicion, sheet_name in enumerate(guardado.pop('originales')):
+                originales[sheet_name] = pd.read_pickle(os.path.join(self._ruta(clave), f'original_{posicion}.pkl'))
+        except Exception:
+            originales.liberar()
+            return None
+        return {**guardado, 'originales': originales}
+    
+    def _escribir_disco(self, clave, libro):
+        """Guarda un libro en disco de forma atómica (escritura en temporal y renombrado)
+
+        Se escribe un directorio con los datos procesados en 'libro.pkl' y un archivo
+        por hoja original, copiando las que ya estaban volcadas a disco.
+        """
+        if not self.directorio:
+            return
+        temporal = tempfile.mkdtemp(suffix='.tmp', dir=self.directorio)
+        try:
+            for posicion, sheet_name in enumerate(libro['originales']):
+                libro['originales'].guardar_hoja(sheet_name, os.path.join(temporal, f'original_{posicion}.pkl'))
+            guardado = {**libro, 'originales': list(libro['originales'])}
+            with open(os.path.join(temporal, 'libro.pkl'), 'wb') as archivo:
+                pickle.dump(guardado, archivo, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporal, self._ruta(clave))
+        except OSError:
+            # Un fallo al escribir en disco (o que otro proceso ya lo haya guardado)
+            # no impide usar el resultado en memoria
+            shutil.rmtree(temporal, ignore_errors=True)
+
+# Instancia compartida por todas las sesiones de Streamlit del proceso
+CACHE_LIBROS = CacheLibros()
@@ -1,5 +1,8 @@
 import pandas as pd
-from app import extract_numeric_value, process_excel_data
+from procesamiento import (extract_numeric_value, process_excel_data, normalizar_texto,
+                          normalizar_ins, ingrediente_canonico, IndiceDosis,
+                          procesar_datos_vectorizado, calcular_resumen_hoja)
+import random
 
 def test_special_characters():
     """Prueba caracteres especiales y formatos inusuales"""
@@ -182,6 +185,99 @@ def test_real_world_complex_case():
     print(result.to_string())
     print(f"\n{len(df)} registros -> {len(result)} grupos\n")
 
+def test_ingredient_normalization():
+    """Prueba la normalización de textos y el diccionario de sinónimos"""
+    print("=== TEST: Normalización de ingredientes ===\n")
+    
+    assert normalizar_texto("Ácido ascórbico, L-") == "acido ascorbico l"
+    assert normalizar_texto("  ACIDO   ascorbico L ") == "acido ascorbico l"
+    assert normalizar_ins("339(i) – (iii)") == normalizar_ins("339(i)-(iii)")
+    assert normalizar_ins("339(i)-(iii)") != normalizar_ins("339(ii)-(ii)")
+    assert ingrediente_canonico("acido ascorbico L") == "Ácido ascórbico, L-"
+    assert ingrediente_canonico("Ingrediente desconocido") == "Ingrediente desconocido"
+    
+    df = pd.DataFrame({
+        'Clasificacion': ['Enriquecimiento (vitamina C)', 'enriquecimiento vitamina c', 'Estabilizante'],
+        'N_INS': ['300', ' 300', '331(iii)'],
+        'Ingrediente': ['Ácido ascórbico, L-', 'acido ascorbico L', 'Citrato trisódico'],
+        'Dosis_Maxima': ['100 mg/kg', '200 mg/kg', 'BPF']
+    })
+    
+    result = process_excel_data(df.copy())
+    print(result.to_string())
+    assert len(result) == 2
+    fila = result[result['Nº INS'] == '300'].iloc[0]
+    assert fila['Ingrediente'] == 'Ácido ascórbico, L-'
+    assert fila['Dosis Mínima'] == '100.0 mg/kg'
+    assert fila['Dosis Máxima'] == '200.0 mg/kg'
+    
+    # Sin normalizar se mantiene la agrupación literal
+    result_literal = process_excel_data(df.copy(), normalizar=False)
+    assert len(result_literal) == 3
+    print("✓ Normaliza y deduplica ingredientes\n")
+
+def test_classification_spelling_variants():
+    """Variantes de escritura de una clasificación se muestran y ordenan como una sola"""
+    print("=== TEST: Variantes de una misma clasificación ===\n")
+    
+    df = pd.DataFrame({
+        'Clasificacion': ['Estabilizante', 'ESTABILIZANTE', 'Emulsionante', 'estabilizánte'],
+        'N_INS': ['100', '200', '300', '331'],
+        'Ingrediente': ['A', 'B', 'C', 'D'],
+        'Dosis_Maxima': ['10 mg/kg', '20 mg/kg', 'BPF', '5 mg/kg']
+    })
+    
+    for motor in (process_excel_data, procesar_datos_vectorizado):
+        result = motor(df.copy())
+        print(result.to_string())
+        assert result['Clasificación'].tolist() == ['Emulsionante', 'Estabilizante', 'Estabilizante', 'Estabilizante']
+        assert result['Nº INS'].tolist() == ['300', '100', '200', '331']
+        assert calcular_resumen_hoja(df, result)['Clasificaciones únicas'] == 2
+    print("✓ Un solo texto y una sola posición por clasificación normalizada\n")
+
+def test_dose_interval_index():
+    """Prueba las consultas por rango de dosis contra una búsqueda exhaustiva"""
+    print("=== TEST: Índice de intervalos de dosis ===\n")
+    
+    generador = random.Random(29)
+    processed_data = {}
+    for hoja in ['Hoja A', 'Hoja B']:
+        filas = []
+        for n in range(300):
+            minimo = generador.choice([1, 5, 50, 200, 500, 1500, 0.5])
+            maximo = minimo + generador.choice([0, 10, 100, 1000, 2500])
+            bpf = generador.random() < 0.2
+            filas.append({
+                'Clasificación': f'Clase {n % 7}',
+                'Nº INS': str(n),
+                'Ingrediente': f'Ingrediente {n}',
+                'Dosis Mínima': 'BPF' if bpf else f"{float(minimo)} mg/kg",
+                'Dosis Máxima': 'BPF' if bpf else f"{float(maximo)} mg/kg"
+            })
+        processed_data[hoja] = pd.DataFrame(filas)
+    
+    indice = IndiceDosis(processed_data)
+    grupos = indice.grupos
+    minimos = grupos['Dosis Mínima'].str.split().str[0].astype(float)
+    maximos = grupos['Dosis Máxima'].str.split().str[0].astype(float)
+    assert len(indice) == sum((df['Dosis Mínima'] != 'BPF').sum() for df in processed_data.values())
+    
+    for desde, hasta in [(200, 1500), (0, 1), (10, 10), (5000, 9000), (0, 10000), (600, 700)]:
+        esperados = {
+            'solapan': (minimos <= hasta) & (maximos >= desde),
+            'contenidos': (minimos >= desde) & (maximos <= hasta),
+            'maxima': maximos.between(desde, hasta),
+            'minima': minimos.between(desde, hasta)
+        }
+        for modo, mascara in esperados.items():
+            resultado = indice.consultar(modo, desde, hasta)
+            pd.testing.assert_frame_equal(resultado, grupos[mascara].reset_index(drop=True))
+        print(f"✓ [{desde}, {hasta}]: {mascara.sum()} grupos con dosis mínima en el rango")
+    
+    assert len(IndiceDosis({}).solapan(0, 100)) == 0
+    assert len(IndiceDosis({}).contenidos_en(0, 100)) == 0
+    print("✓ Consultas equivalentes a la búsqueda exhaustiva\n")
+
 if __name__ == "__main__":
     print("=" * 70)
     print("SUITE DE PRUEBAS AVANZADAS - Procesador de Ingredientes")
@@ -197,6 +293,9 @@ if __name__ == "__main__":
     test_null_and_empty_values()
     test_same_ingredient_different_ins()
     test_real_world_complex_case()
+    test_ingredient_normalization()
+    test_classification_spelling_variants()
+    test_dose_interval_index()
     
     print("=" * 70)
     print("PRUEBAS AVANZADAS COMPLETADAS")
@@ -1,9 +1,10 @@
 import pandas as pd
+import subprocess
 import sys
 from io import StringIO
 
 # Importar las funciones del app
-from app import extract_numeric_value, process_excel_data
+from procesamiento import extract_numeric_value, process_excel_data
 
 def test_extract_numeric_value():
     """Prueba la función de extracción de valores numéricos"""
@@ -219,6 +220,17 @@ def test_edge_cases():
     
     return all_passed
 
+def test_lazy_excel_engines():
+    """Verifica que los motores de Excel no se cargan al importar la aplicación"""
+    print("=== TEST: Importación diferida de motores Excel ===\n")
+    
+    codigo = "import sys, procesamiento; print(sorted(m for m in ('openpyxl', 'xlrd') if m in sys.modules))"
+    salida = subprocess.run([sys.executable, '-c', codigo], capture_output=True, text=True, check=True)
+    cargados = salida.stdout.strip()
+    print(f"Motores cargados tras importar procesamiento: {cargados}")
+    assert cargados == '[]'
+    print("✓ Los motores de Excel se cargan solo al leer o escribir archivos\n")
+
 if __name__ == "__main__":
     print("=" * 60)
     print("SUITE DE PRUEBAS - Procesador de Ingredientes")
@@ -228,6 +240,7 @@ if __name__ == "__main__":
     test1 = test_extract_numeric_value()
     test2 = test_process_excel_data()
     test3 = test_edge_cases()
+    test_lazy_excel_engines()
     
     print("=" * 60)
     if test1 and test2 and test3:
@@ -0,0 +1,149 @@
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from procesamiento import MOTORES_PROCESAMIENTO, process_excel_data
+
+# Valores con los que se generan hojas aleatorias (incluyen variantes que la
+# normalización debe unificar, blancos, 'None' y valores nulos)
+CLASIFICACIONES = [
+    'Estabilizante', 'estabilizante ', 'ESTABILIZANTE', 'Conservante', 'Conservación',
+    'Conservacion', 'Colorante', 'Estabilizante / emulsionante', 'Estabilizante - emulsionante',
+    'Enriquecimiento (vitamina C)', '', '   ', 'None', None, np.nan
+]
+NUMEROS_INS = [
+    '100', '200', ' 200', '300', '331(iii)', '338; 339(i)–(iii)', '338; 339(i)-(iii)',
+    '450(i)-(iii),(v)-(vii)', '450(i)–(iii),(v)–(vii)', '339(ii)-(ii)', '941', 941, 300.0,
+    '', 'None', None, np.nan
+]
+INGREDIENTES = [
+    'Ácido ascórbico, L-', 'acido ascorbico L', 'Vitamina C', 'Citrato trisódico',
+    'citrato de sodio', 'Nitrógeno', 'Curcumina', 'Fosfatos', 'β-caroteno', '', 'None', None, np.nan
+]
+DOSIS = [
+    'BPF', 'bpf', '  BPF  ', '1500 mg/kg', '1500.0 mg/kg', '0.5 mg/kg', '2000.5', '1,500 mg/kg',
+    '< 1000 mg/kg', '≤ 200 mg/kg', '500-1000 mg/kg', 'No especificado', 'N/A', '-', 300, 40.5,
+    0, '', 'None', None, np.nan, pd.NA
+]
+
+def generar_hoja_aleatoria(filas, semilla):
+    """Genera una hoja con el formato leído del Excel (4 columnas) a partir de una semilla"""
+    generador = np.random.default_rng(semilla)
+
+    def columna(valores):
+        indices = generador.integers(0, len(valores), size=filas)
+        return np.array(valores, dtype=object)[indices]
+
+    return pd.DataFrame({
+        'Clasificación': columna(CLASIFICACIONES),
+        'Nº INS': columna(NUMEROS_INS),
+        'Ingrediente': columna(INGREDIENTES),
+        'Dosis máxima': columna(DOSIS)
+    })
+
+def comparar_con_referencia(df):
+    """Compara cada motor con process_excel_data, con y sin normalización"""
+    for normalizar in (True, False):
+        referencia = process_excel_data(df.copy(), normalizar=normalizar)
+        for nombre, motor in MOTORES_PROCESAMIENTO.items():
+            if motor is process_excel_data:
+                continue
+            resultado = motor(df.copy(), normalizar=normalizar)
+            pd.testing.assert_frame_equal(resultado, referencia, check_exact=True, obj=f"motor '{nombre}'")
+
+def medir_motor(motor, df, repeticiones=1):
+    """Devuelve el menor tiempo (s) de procesar df con el motor indicado"""
+    tiempos = []
+    for _ in range(repeticiones):
+        copia = df.copy()
+        inicio = time.perf_counter()
+        motor(copia)
+        tiempos.append(time.perf_counter() - inicio)
+    return min(tiempos)
+
+def medir_escalado(tamanos, motores=None, semilla=0):
+    """Mide el tiempo de cada motor para cada número de filas"""
+    motores = motores or MOTORES_PROCESAMIENTO
+    tiempos = {nombre: {} for nombre in motores}
+    for filas in tamanos:
+        df = generar_hoja_aleatoria(filas, semilla)
+        for nombre, motor in motores.items():
+            tiempos[nombre][filas] = medir_motor(motor, df, repeticiones=3 if filas <= 10_000 else 1)
+    return tiempos
+
+def crecimiento_superlineal(tiempos_por_tamano, tolerancia=3.0):
+    """Devuelve los saltos de tamaño en los que el tiempo crece más que tolerancia × lineal"""
+    tamanos = sorted(tiempos_por_tamano)
+    saltos = []
+    for menor, mayor in zip(tamanos, tamanos[1:]):
+        crecimiento = tiempos_por_tamano[mayor] / max(tiempos_por_tamano[menor], 1e-9)
+        if crecimiento > (mayor / menor) * tolerancia:
+            saltos.append((menor, mayor, crecimiento))
+    return saltos
+
+def test_random_sheets_match_reference():
+    """Hojas aleatorias: todos los motores producen exactamente el resultado de referencia"""
+    print("=== TEST: Equivalencia de motores en hojas aleatorias ===\n")
+
+    for semilla in range(100):
+        filas = int(np.random.default_rng(semilla).integers(0, 200))
+        comparar_con_referencia(generar_hoja_aleatoria(filas, semilla))
+    print(f"✓ 100 hojas aleatorias equivalentes a la referencia en {len(MOTORES_PROCESAMIENTO) - 1} motor(es)\n")
+
+def test_edge_sheets_match_reference():
+    """Casos límite: hoja vacía, todo inválido, todo BPF y una sola fila"""
+    print("=== TEST: Equivalencia de motores en casos límite ===\n")
+
+    columnas = ['Clasificación', 'Nº INS', 'Ingrediente', 'Dosis máxima']
+    casos = {
+        'vacía': pd.DataFrame(columns=columnas),
+        'todo inválido': pd.DataFrame([[None, '100', 'x', 'BPF'], ['A', 'None', 'y', '10'], ['', '', '', '']], columns=columnas),
+        'todo BPF': pd.DataFrame([['A', '1', 'x', 'BPF'], ['A', '1', 'x', 'bpf'], ['B', '2', None, None]], columns=columnas),
+        'una fila': pd.DataFrame([['A', '1', 'None', '0.001 mg/kg']], columns=columnas),
+    }
+    for nombre, df in casos.items():
+        comparar_con_referencia(df)
+        print(f"✓ {nombre}")
+    print()
+
+def test_scaling_is_linear():
+    """El tiempo de cada motor crece como mucho linealmente (con tolerancia) de 10³ a 10⁴ filas"""
+    print("=== TEST: Escalado de motores ===\n")
+
+    tiempos = medir_escalado([1_000, 10_000])
+    for nombre, por_tamano in tiempos.items():
+        print(f"{nombre}: " + ", ".join(f"{filas} filas: {t * 1000:.1f} ms" for filas, t in por_tamano.items()))
+        assert not crecimiento_superlineal(por_tamano), f"Crecimiento superlineal en '{nombre}'"
+    print()
+
+if __name__ == "__main__":
+    print("=" * 70)
+    print("ARNÉS DE EQUIVALENCIA Y ESCALADO - process_excel_data")
+    print("=" * 70)
+    print()
+
+    test_random_sheets_match_reference()
+    test_edge_sheets_match_reference()
+
+    # Tamaños de 10³ a 10⁶ filas (se puede limitar con un argumento: 10⁵ -> 5)
+    exponente_maximo = int(sys.argv[1]) if len(sys.argv) > 1 else 6
+    tamanos = [10 ** exponente for exponente in range(3, exponente_maximo + 1)]
+    tiempos = medir_escalado(tamanos)
+
+    print(f"{'Filas':>10} | " + " | ".join(f"{nombre:>12}" for nombre in tiempos))
+    for filas in tamanos:
+        print(f"{filas:>10} | " + " | ".join(f"{tiempos[nombre][filas]:>11.3f}s" for nombre in tiempos))
+    print()
+
+    hay_regresion = False
+    for nombre, por_tamano in tiempos.items():
+        for menor, mayor, crecimiento in crecimiento_superlineal(por_tamano):
+            hay_regresion = True
+            print(f"✗ '{nombre}': de {menor} a {mayor} filas el tiempo crece x{crecimiento:.1f}")
+
+    print("=" * 70)
+    print("✗ CRECIMIENTO SUPERLINEAL DETECTADO" if hay_regresion else "✓ ESCALADO LINEAL EN TODOS LOS MOTORES")
+    print("=" * 70)
+    sys.exit(1 if hay_regresion else 0)
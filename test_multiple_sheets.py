@@ -1,6 +1,13 @@
 import pandas as pd
 from io import BytesIO
-from app import process_excel_data, convert_multiple_sheets_to_excel
+import os
+import tempfile
+import threading
+import time
+import cli
+from procesamiento import (process_excel_data, convert_multiple_sheets_to_excel, AlmacenHojas, ArchivoTemporal,
+                          calcular_resumen_hoja, resumen_a_dataframe, comparar_libros, procesar_libro,
+                          CacheLibros, detectar_encabezado)
 
 def create_test_excel_with_multiple_sheets():
     """Crea un archivo Excel de prueba con múltiples hojas"""
@@ -121,5 +128,312 @@ def test_multiple_sheets_processing():
     
     return all_success
 
+def test_memory_budget_spill():
+    """Prueba el volcado a disco de las hojas que superan el presupuesto"""
+    print("=" * 70)
+    print("TEST: Presupuesto de memoria con volcado a disco")
+    print("=" * 70)
+    print()
+    
+    hoja_pequena = pd.DataFrame({'Clasificación': ['A'], 'Nº INS': ['100']})
+    hoja_grande = pd.DataFrame({'Clasificación': ['Conservante'] * 5000, 'Nº INS': ['200'] * 5000})
+    presupuesto = int(hoja_pequena.memory_usage(deep=True).sum()) + 100
+    
+    almacen = AlmacenHojas(presupuesto)
+    almacen['Pequeña'] = hoja_pequena
+    almacen['Grande'] = hoja_grande
+    
+    assert list(almacen) == ['Pequeña', 'Grande']
+    assert almacen.hojas_en_disco == ['Grande']
+    assert almacen.bytes_en_memoria <= presupuesto
+    pd.testing.assert_frame_equal(almacen['Grande'], hoja_grande)
+    print(f"✓ Hojas en disco: {almacen.hojas_en_disco}")
+    
+    # guardar_hoja escribe tanto las hojas en memoria como las volcadas a disco
+    with tempfile.TemporaryDirectory() as directorio:
+        for nombre, hoja in [('Pequeña', hoja_pequena), ('Grande', hoja_grande)]:
+            almacen.guardar_hoja(nombre, os.path.join(directorio, 'hoja.pkl'))
+            pd.testing.assert_frame_equal(pd.read_pickle(os.path.join(directorio, 'hoja.pkl')), hoja)
+    
+    ruta = almacen._hojas['Grande']
+    almacen.liberar()
+    assert len(almacen) == 0 and not os.path.exists(ruta)
+    print("✓ Archivos temporales eliminados\n")
+
+def test_sheet_summary():
+    """Prueba el resumen por hoja y su exportación como hoja Resumen"""
+    print("=" * 70)
+    print("TEST: Resumen por hoja")
+    print("=" * 70)
+    print()
+    
+    original = pd.DataFrame({
+        'Clasificación': ['Conservante', 'Conservante', 'Colorante', 'Colorante', 'Gas'],
+        'Nº INS': ['200', '200', '100', '102', '941'],
+        'Ingrediente': ['Ácido sórbico', 'Ácido sórbico', 'Curcumina', 'Tartrazina', 'Nitrógeno'],
+        'Dosis máxima': ['1000 mg/kg', '500 mg/kg', 'BPF', 'No especificado', None]
+    })
+    procesado = process_excel_data(original.copy(deep=False))
+    resumen = calcular_resumen_hoja(original, procesado)
+    print(resumen)
+    
+    assert resumen['Registros originales'] == 5
+    assert resumen['Registros procesados'] == 4
+    assert resumen['Clasificaciones únicas'] == 3
+    assert resumen['Proporción BPF'] == 0.75
+    assert resumen['Dosis mínima (mg/kg)'] == 500.0
+    assert resumen['Mediana (mg/kg)'] == 750.0
+    assert resumen['Dosis máxima (mg/kg)'] == 1000.0
+    assert resumen['Dosis no interpretadas'] == 1
+    # Los datos originales no se modifican al procesar una copia superficial
+    assert list(original.columns)[0] == 'Clasificación'
+    
+    resumen_df = resumen_a_dataframe({'Resumen': resumen})
+    salida = convert_multiple_sheets_to_excel({'Resumen': procesado}, resumen_df=resumen_df)
+    hojas = pd.ExcelFile(salida).sheet_names
+    assert hojas == ['Resumen', '_Resumen']
+    print(f"✓ Hojas exportadas: {hojas}\n")
+
+def test_batch_cli():
+    """Prueba los comandos procesar y consultar de la línea de comandos"""
+    print("=" * 70)
+    print("TEST: Línea de comandos")
+    print("=" * 70)
+    print()
+    
+    with tempfile.TemporaryDirectory() as directorio:
+        entrada = os.path.join(directorio, 'libro.xlsx')
+        with open(entrada, 'wb') as archivo:
+            archivo.write(create_test_excel_with_multiple_sheets().read())
+        
+        salida = os.path.join(directorio, 'procesado.xlsx')
+        assert cli.main(['procesar', entrada, '-o', salida]) == 0
+        hojas = pd.ExcelFile(salida).sheet_names
+        assert hojas == ['Estabilizantes', 'Conservantes', 'Colorantes', 'Resumen']
+        print(f"✓ procesar: {hojas}")
+        
+        consulta = os.path.join(directorio, 'consulta.csv')
+        assert cli.main(['consultar', entrada, '--desde', '200', '--hasta', '1500', '-o', consulta]) == 0
+        resultado = pd.read_csv(consulta, dtype=str)
+        print(resultado.to_string(index=False))
+        assert sorted(resultado['Nº INS']) == ['200', '211', '331']
+        print("✓ consultar: dosis máxima entre 200 y 1500 mg/kg")
+        
+        cambios = os.path.join(directorio, 'cambios.csv')
+        assert cli.main(['comparar', entrada, entrada, '-o', cambios]) == 0
+        assert pd.read_csv(cambios).empty
+        print("✓ comparar: sin cambios entre un libro y sí mismo\n")
+
+def test_workbook_comparison():
+    """Prueba la comparación de dos ediciones de un libro"""
+    print("=" * 70)
+    print("TEST: Comparación de ediciones")
+    print("=" * 70)
+    print()
+    
+    columnas = ['Clasificación', 'Nº INS', 'Ingrediente', 'Dosis Mínima', 'Dosis Máxima']
+    anterior = {
+        'Conservantes': pd.DataFrame([
+            ['Conservante', '200', 'Ácido sórbico', '500.0 mg/kg', '1000.0 mg/kg'],
+            ['Conservante', '211', 'Benzoato de sodio', '300.0 mg/kg', '300.0 mg/kg'],
+            ['Conservante', '220', 'Dióxido de azufre', 'BPF', 'BPF'],
+        ], columns=columnas),
+        'Colorantes': pd.DataFrame([['Colorante', '100', 'Curcumina', 'BPF', 'BPF']], columns=columnas)
+    }
+    nuevo = {
+        'Conservantes': pd.DataFrame([
+            ['conservante', '200', 'Ácido sórbico', '500.0 mg/kg', '1500.0 mg/kg'],
+            ['Conservante', '211', 'Benzoato de sodio', '300.0 mg/kg', '300.0 mg/kg'],
+            ['Conservante', '234', 'Nisina', '12.5 mg/kg', '12.5 mg/kg'],
+        ], columns=columnas),
+        # Mismo grupo en otra hoja: es un grupo distinto
+        'Otros': pd.DataFrame([['Colorante', '100', 'Curcumina', 'BPF', 'BPF']], columns=columnas)
+    }
+    
+    resultado = comparar_libros(anterior, nuevo)
+    print(resultado.to_string())
+    
+    cambios = {(fila['Hoja'], fila['Nº INS']): fila['Estado'] for _, fila in resultado.iterrows()}
+    assert cambios == {
+        ('Colorantes', '100'): 'Eliminado',
+        ('Conservantes', '200'): 'Modificado',
+        ('Conservantes', '220'): 'Eliminado',
+        ('Conservantes', '234'): 'Añadido',
+        ('Otros', '100'): 'Añadido',
+    }
+    modificado = resultado[resultado['Estado'] == 'Modificado'].iloc[0]
+    assert modificado['Dosis Máxima anterior'] == '1000.0 mg/kg'
+    assert modificado['Dosis Máxima nueva'] == '1500.0 mg/kg'
+    assert comparar_libros(nuevo, nuevo).empty
+    print("✓ Grupos añadidos, eliminados y modificados detectados\n")
+
+def test_shared_workbook_cache():
+    """Prueba la caché compartida: deduplicación de peticiones simultáneas y disco"""
+    print("=" * 70)
+    print("TEST: Caché compartida de libros procesados")
+    print("=" * 70)
+    print()
+    
+    contenido = create_test_excel_with_multiple_sheets().read()
+    llamadas = []
+    
+    def procesar_lento(archivo, presupuesto_bytes):
+        llamadas.append(1)
+        time.sleep(0.2)
+        return procesar_libro(archivo, presupuesto_bytes)
+    
+    with tempfile.TemporaryDirectory() as directorio:
+        cache = CacheLibros(directorio=directorio, procesar=procesar_lento)
+        
+        # Diez sesiones suben el mismo archivo a la vez: se procesa una sola vez
+        resultados = [None] * 10
+        def sesion(indice):
+            resultados[indice] = cache.obtener(contenido)
+        hilos = [threading.Thread(target=sesion, args=(i,)) for i in range(10)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        
+        assert len(llamadas) == 1
+        assert all(resultado is resultados[0] for resultado in resultados)
+        assert (cache.fallos, cache.aciertos) == (1, 9)
+        print(f"✓ 10 peticiones simultáneas, {len(llamadas)} procesamiento")
+        
+        # Con la clave ya calculada, el contenido solo se lee si hay que procesarlo
+        def leer_prohibido():
+            raise AssertionError("No debería leerse el contenido")
+        assert cache.obtener_por_clave(CacheLibros.clave(contenido), leer_prohibido) is resultados[0]
+        
+        # Otro contenido es otra entrada
+        otro = create_test_excel_with_multiple_sheets()
+        with pd.ExcelWriter(otro, engine='openpyxl', mode='a') as writer:
+            pd.DataFrame({'x': [1]}).to_excel(writer, sheet_name='Extra')
+        cache.obtener(otro.getvalue())
+        assert len(llamadas) == 2 and len(cache) == 2
+        
+        # Un proceso nuevo con el mismo directorio reutiliza el resultado en disco
+        def procesar_prohibido(archivo, presupuesto_bytes):
+            raise AssertionError("No debería procesarse de nuevo")
+        
+        cache_nueva = CacheLibros(directorio=directorio, procesar=procesar_prohibido)
+        libro = cache_nueva.obtener(contenido)
+        for sheet_name, df in resultados[0]['procesados'].items():
+            pd.testing.assert_frame_equal(libro['procesados'][sheet_name], df)
+        assert list(libro['originales']) == list(resultados[0]['originales'])
+        for sheet_name in resultados[0]['originales']:
+            pd.testing.assert_frame_equal(libro['originales'][sheet_name], resultados[0]['originales'][sheet_name])
+        # Cada libro se guarda en un directorio con un archivo por hoja original
+        for guardado in os.listdir(directorio):
+            archivos = os.listdir(os.path.join(directorio, guardado))
+            assert 'libro.pkl' in archivos and len(archivos) > 1
+        print("✓ Resultado recuperado desde disco")
+        
+        # Los errores no se guardan en la caché
+        cache_errores = CacheLibros(procesar=procesar_prohibido)
+        for _ in range(2):
+            try:
+                cache_errores.obtener(contenido)
+                assert False
+            except AssertionError as e:
+                assert "No debería" in str(e)
+        assert len(cache_errores) == 0
+        print("✓ Los errores no se guardan")
+        
+        # Con un presupuesto mínimo, las hojas originales van a disco y solo queda el último libro
+        cache_pequena = CacheLibros(presupuesto_bytes=1)
+        libro = cache_pequena.obtener(contenido)
+        assert libro['originales'].hojas_en_disco == list(libro['originales'])
+        cache_pequena.obtener(otro.getvalue())
+        assert len(cache_pequena) == 1
+        assert cache_pequena.bytes_en_memoria > 0
+        print("✓ La caché respeta el presupuesto de memoria del proceso")
+        
+        # Los resultados derivados se construyen una vez y salen de la caché con su libro
+        construcciones = []
+        def construir_exportacion():
+            construcciones.append(1)
+            return ArchivoTemporal(BytesIO(b'excel'))
+        clave_otro = CacheLibros.clave(otro.getvalue())
+        for _ in range(2):
+            exportacion = cache_pequena.derivado(clave_otro, 'exportacion', construir_exportacion)
+        assert len(construcciones) == 1 and exportacion.leer() == b'excel'
+        cache_pequena.obtener(contenido)
+        cache_pequena.derivado(clave_otro, 'exportacion', construir_exportacion)
+        assert len(construcciones) == 2
+        ruta = exportacion.ruta
+        exportacion.liberar()
+        assert not os.path.exists(ruta)
+        print("✓ Resultados derivados compartidos y expulsados con su libro\n")
+
+def test_header_detection():
+    """Prueba la detección del encabezado y los motivos de las hojas omitidas"""
+    print("=" * 70)
+    print("TEST: Detección de encabezado")
+    print("=" * 70)
+    print()
+    
+    datos = pd.DataFrame({
+        'Clasificación': ['Conservante', 'Conservante', 'Colorante'],
+        'Nº INS': [200, 200, 100],
+        'Ingrediente': ['Ácido sórbico', 'Ácido sórbico', 'Curcumina'],
+        'Dosis máxima': ['1000 mg/kg', '1500 mg/kg', 'BPF']
+    })
+    
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        # Encabezado en D6, con columnas en otro orden, otra columna y una fila vacía
+        desplazada = datos[['Nº INS', 'Ingrediente', 'Clasificación', 'Dosis máxima']].copy()
+        desplazada.columns = ['N° INS', 'INGREDIENTE', 'Clasificacion', 'Dosis máxima (mg/kg)']
+        desplazada.insert(2, 'Notas', 'x')
+        desplazada = pd.concat([pd.DataFrame([[None] * 5], columns=desplazada.columns), desplazada])
+        desplazada.to_excel(writer, sheet_name='Desplazada', index=False, startrow=5, startcol=3)
+        # Formato clásico desde B2 con títulos no reconocibles
+        clasica = datos.copy()
+        clasica.columns = ['Tipo', 'Código', 'Nombre', 'Límite']
+        clasica.to_excel(writer, sheet_name='Clásica', index=False, startrow=1, startcol=1)
+        # Formato clásico desde B2 sin título en E2
+        pd.DataFrame([['Tipo', 'Código', 'Nombre']]).to_excel(
+            writer, sheet_name='Sin título', index=False, header=False, startrow=1, startcol=1
+        )
+        clasica.to_excel(writer, sheet_name='Sin título', index=False, header=False, startrow=2, startcol=1)
+        # Una columna de dosis mínima antes de la máxima
+        con_minima = datos.copy()
+        con_minima.insert(3, 'Dosis mínima', ['1 mg/kg', '2 mg/kg', 'BPF'])
+        con_minima.to_excel(writer, sheet_name='Con mínima', index=False)
+        pd.DataFrame().to_excel(writer, sheet_name='Vacía')
+        datos.iloc[:0].to_excel(writer, sheet_name='Sin datos', index=False, startcol=1)
+        pd.DataFrame({'Notas': ['Hoja de notas']}).to_excel(writer, sheet_name='Notas', index=False)
+    output.seek(0)
+    
+    libro = procesar_libro(output)
+    for sheet_name, df in libro['procesados'].items():
+        print(f"--- {sheet_name} ---")
+        print(df.to_string())
+    print(libro['omitidas'])
+    
+    esperado = process_excel_data(datos.copy())
+    pd.testing.assert_frame_equal(libro['procesados']['Desplazada'], esperado)
+    pd.testing.assert_frame_equal(libro['procesados']['Clásica'], esperado)
+    pd.testing.assert_frame_equal(libro['procesados']['Con mínima'], esperado)
+    pd.testing.assert_frame_equal(libro['procesados']['Sin título'], esperado)
+    assert set(libro['omitidas']) == {'Vacía', 'Sin datos', 'Notas'}
+    assert libro['omitidas']['Vacía'] == "Hoja vacía"
+    assert "filas de datos" in libro['omitidas']['Sin datos']
+    assert "No se encontró el encabezado" in libro['omitidas']['Notas']
+    
+    muestra = pd.DataFrame([[None, 'Dosis', 'Ingrediente', 'INS', 'Clasificación']])
+    assert detectar_encabezado(muestra) == (0, [4, 3, 2, 1])
+    # Varias columnas de dosis sin ninguna "máxima": el encabezado es ambiguo
+    muestra = pd.DataFrame([['Clasificación', 'Nº INS', 'Ingrediente', 'Dosis mínima', 'Dosis']])
+    assert detectar_encabezado(muestra) is None
+    print("✓ Encabezados detectados y hojas omitidas con motivo\n")
+
 if __name__ == "__main__":
     test_multiple_sheets_processing()
+    test_memory_budget_spill()
+    test_sheet_summary()
+    test_batch_cli()
+    test_workbook_comparison()
+    test_shared_workbook_cache()
+    test_header_detection()